@@ -1,5 +1,4 @@
 from collections import defaultdict
-from copy import deepcopy
 import random
 from typing import Any, Dict, List
 from functools import partial
@@ -282,7 +281,8 @@ def convert_elem_dict_to_str_legacy(elem_dict: dict):
     """
     Convert an element dictionary to a string.
     """
-    elem_dict = deepcopy(elem_dict)
+    # Only the top-level keys are removed below, so a shallow copy is enough
+    elem_dict = dict(elem_dict)
 
     element_str = f"[[tag]] {elem_dict.pop('tag')}\n"
     element_str += f"[[xpath]] {elem_dict.pop('xpath')}\n"
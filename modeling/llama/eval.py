@@ -18,6 +18,7 @@ from transformers.pipelines.pt_utils import KeyDataset
 import weblinx as wl
 from weblinx.processing import load_candidate_elements
 from weblinx.processing.prompt import build_input_records_from_selected_turns, select_turns_and_candidates_for_prompts
+from weblinx.utils.format import format_output_dictionary
 from weblinx.utils.hydra import save_path_to_hydra_logs
 
 from .processing import (
@@ -69,6 +70,7 @@ def main(cfg):
         format_intent=format_intent,
         build_prompt_records_fn=build_prompt_records_fn,
         format_prompt_records_fn=None,
+        format_output_dict_fn=partial(format_output_dictionary, function_key="intent"),
     )
 
     template_tokenizer = AutoTokenizer.from_pretrained(cfg.model.template_tokenizer)
@@ -1,4 +1,3 @@
-from copy import deepcopy
 from functools import partial
 from typing import Callable
 
@@ -15,6 +14,7 @@ from weblinx.processing.prompt import (
     multi_attempt_format_prev_turns_truncated,
 )
 from weblinx.processing.truncation import (
+    get_num_tokens,
     multi_attempt_truncate_cands_turn,
     multi_attempt_truncate_dom_tree,
 )
@@ -115,6 +115,26 @@ def merge_prev_turns(prev_turns_text_list, final_user_message):
     return prev_turns_merged
 
 
+def _truncate_html_for_prompt(
+    html,
+    cands_turn,
+    tokenizer,
+    max_html_tokens,
+    allow_iterative_reduction=False,
+    parser=None,
+):
+    dom_tree_raw = lxml.html.fromstring(html, parser=parser)
+    dom_tree_pruned = clean_and_prune_tree(dom_tree_raw, cands_turn=cands_turn)
+    trunc = multi_attempt_truncate_dom_tree(
+        dom_tree=dom_tree_pruned,
+        tokenizer=tokenizer,
+        max_tokens=max_html_tokens,
+        warn_after_attempts=False,
+        allow_iterative_reduction=allow_iterative_reduction,
+    )
+    return trunc["tree_repr"]
+
+
 def build_prompt_records_for_llama_truncated(
     replay,
     turn,
@@ -143,6 +163,7 @@ def build_prompt_records_for_llama_truncated(
     use_tokenizer_template=False,
     template_tokenizer=None,
     parser=None,
+    executor=None,
 ):
     """
     Parameters
@@ -156,7 +177,26 @@ def build_prompt_records_for_llama_truncated(
         tokens from the input. For example, if we remove a token that is part of a word, but
         the updated text is retokenized to the same number of tokens, then we will continue
         to remove tokens until we reach the max_tokens limit.
+
+    executor : concurrent.futures.Executor, optional
+        If given (e.g. a ThreadPoolExecutor), the HTML is parsed, pruned and truncated in
+        the executor while the utterances and previous turns are truncated, since they
+        do not depend on each other. lxml and fast tokenizers release the GIL for most
+        of their work, so threads can run these steps concurrently. Defaults to None.
     """
+    include_dom = include_html and turn.html not in ["", None] and cands_turn is not None
+    html_kwargs = dict(
+        html=turn.html,
+        cands_turn=cands_turn,
+        tokenizer=tokenizer,
+        max_html_tokens=max_html_tokens,
+        allow_iterative_reduction=allow_iterative_reduction,
+        parser=parser,
+    )
+    html_future = None
+    if include_dom and executor is not None:
+        html_future = executor.submit(_truncate_html_for_prompt, **html_kwargs)
+
     if system_prompt_template is None:
         system_prompt_template = get_system_prompt_template_for_llama_mc_concise()
 
@@ -204,17 +244,11 @@ def build_prompt_records_for_llama_truncated(
         num_prev_turns=num_prev_turns,
     )
 
-    if include_html and turn.html not in ["", None] and cands_turn is not None:
-        dom_tree_raw = lxml.html.fromstring(turn.html, parser=parser)
-        dom_tree_pruned = clean_and_prune_tree(dom_tree_raw, cands_turn=cands_turn)
-        trunc = multi_attempt_truncate_dom_tree(
-            dom_tree=dom_tree_pruned,
-            tokenizer=tokenizer,
-            max_tokens=max_html_tokens,
-            warn_after_attempts=False,
-            allow_iterative_reduction=allow_iterative_reduction,
-        )
-        html = trunc["tree_repr"]
+    if include_dom:
+        if html_future is not None:
+            html = html_future.result()
+        else:
+            html = _truncate_html_for_prompt(**html_kwargs)
         sys_prompt = html + sys_prompt
     else:
         html = ""
@@ -222,14 +256,14 @@ def build_prompt_records_for_llama_truncated(
     if cands_turn is not None:
         if add_unused_len_to_cands:
             # Add the unused length to the candidates
-            num_html_tokens = len(tokenizer.tokenize(html))
-            num_utter_tokens = len(tokenizer.tokenize(utterance_context))
+            num_html_tokens = get_num_tokens(tokenizer, html)
+            num_utter_tokens = get_num_tokens(tokenizer, utterance_context)
             if use_tokenizer_template:
                 if template_tokenizer is None:
                     raise ValueError(
                         "template_tokenizer must be provided when use_tokenizer_template is True."
                     )
-                prev_turns_merged_copy = deepcopy(prev_turns_merged)
+                prev_turns_merged_copy = list(prev_turns_merged)
                 if prev_turns_merged[0]['role'] == 'assistant':
                     # insert a dummy user turn
                     prev_turns_merged_copy.insert(0, {'role': 'user', 'content': ''})
@@ -237,8 +271,8 @@ def build_prompt_records_for_llama_truncated(
                     [{'role': 'system', 'content': ''}, *prev_turns_merged_copy], tokenize=True
                 ))
             else:
-                num_prev_turns_tokens = len(
-                    tokenizer.tokenize(" ".join(prev_turns_text_list))
+                num_prev_turns_tokens = get_num_tokens(
+                    tokenizer, " ".join(prev_turns_text_list)
                 )
             remain_html_tokens = max_html_tokens - num_html_tokens
             remain_utter_tokens = max_utterance_tokens - num_utter_tokens
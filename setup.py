@@ -11,7 +11,7 @@ with open("README.md") as fp:
 extras_require = {
     "dev": ["black", "wheel"],
     "video": ["opencv-python-headless", "numpy", "Pillow"],
-    "processing": ["lxml"],
+    "processing": ["lxml", "numpy"],
     "eval": ["sacrebleu", "numpy", "pandas", "tqdm"],
 }
 # Dynamically create the 'all' extra by combining all other extras
@@ -0,0 +1,164 @@
+import random
+import unittest
+from importlib.util import find_spec
+from unittest.mock import patch
+
+from weblinx.processing import truncation
+from weblinx.processing.truncation import (
+    _batch_truncate_text_at_center,
+    reduce_list_of_lengths,
+    truncate_text_at_center,
+)
+
+_HAS_TOKENIZERS = find_spec("tokenizers") and find_spec("transformers")
+
+WORDS = [
+    "click", "button", "submit", "search", "the", "results", "page", "navigation",
+    "menu", "https://www.example.com/path?query=1", "données", "🙂", "  ", "\n",
+]
+
+
+def make_tokenizer():
+    """
+    Builds a small byte-level BPE tokenizer in memory, so that the tests do not need to
+    download a pretrained one.
+    """
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = Tokenizer(models.BPE(unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=300,
+        special_tokens=["[UNK]"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    )
+    rng = random.Random(0)
+    corpus = [" ".join(rng.choices(WORDS, k=50)) for _ in range(50)]
+    tokenizer.train_from_iterator(corpus, trainer)
+
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+class TestReduceListOfLengths(unittest.TestCase):
+    def test_reduce_list_of_lengths(self):
+        """
+        Test that the lengths are reduced to exactly max_length, with the largest
+        lengths being reduced first, and that they are unchanged if they already fit.
+        """
+        self.assertEqual(reduce_list_of_lengths([1, 2, 10, 20], 33), [1, 2, 10, 20])
+        self.assertEqual(reduce_list_of_lengths([1, 2, 10, 20], 23), [1, 2, 10, 10])
+        self.assertEqual(reduce_list_of_lengths([1, 2, 10, 20], 20), [1, 2, 8, 9])
+        self.assertEqual(reduce_list_of_lengths([1, 2, 10, 20], 0), [0, 0, 0, 0])
+
+    def test_reduce_list_of_lengths_backends(self):
+        """
+        Test that the compiled version (if numba is installed) and the numpy version
+        give the same results as the pure python version.
+        """
+        rng = random.Random(0)
+        cases = []
+        for _ in range(500):
+            lengths = sorted(rng.randint(0, 100) for _ in range(rng.randint(1, 200)))
+            cases.append((lengths, rng.randint(1, sum(lengths) + 5)))
+
+        results = [reduce_list_of_lengths(lengths, m) for lengths, m in cases]
+
+        with patch.object(truncation, "_MIN_NUM_LENGTHS_FOR_NUMPY", 1):
+            with patch.object(truncation, "_MIN_NUM_LENGTHS_FOR_NUMBA", 1):
+                results_nb = [reduce_list_of_lengths(l, m) for l, m in cases]
+
+            with patch.object(truncation, "_reduce_list_of_lengths_nb", None):
+                results_np = [reduce_list_of_lengths(l, m) for l, m in cases]
+
+        with patch.object(truncation, "_MIN_NUM_LENGTHS_FOR_NUMPY", float("inf")):
+            results_py = [reduce_list_of_lengths(l, m) for l, m in cases]
+
+        self.assertEqual(results, results_py)
+        self.assertEqual(results_nb, results_py)
+        self.assertEqual(results_np, results_py)
+        for (lengths, m), result in zip(cases, results):
+            self.assertEqual(sum(result), min(m, sum(lengths)))
+
+
+@unittest.skipUnless(_HAS_TOKENIZERS, "tokenizers and transformers are required")
+class TestBatchTruncateTextAtCenter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tokenizer = make_tokenizer()
+
+        rng = random.Random(0)
+        cls.texts = ["", "click"] + [
+            "".join(rng.choices(WORDS, k=rng.randint(1, 60))) for _ in range(200)
+        ]
+        cls.max_tokens_list = [rng.randint(0, 40) for _ in cls.texts]
+
+    def check_same_as_truncate_text_at_center(self, allow_iterative_reduction):
+        truncs = _batch_truncate_text_at_center(
+            self.texts,
+            self.max_tokens_list,
+            tokenizer=self.tokenizer,
+            allow_iterative_reduction=allow_iterative_reduction,
+        )
+        self.assertEqual(len(truncs), len(self.texts))
+
+        for text, max_tokens, trunc in zip(self.texts, self.max_tokens_list, truncs):
+            with self.subTest(text=text, max_tokens=max_tokens):
+                expected = truncate_text_at_center(
+                    text,
+                    tokenizer=self.tokenizer,
+                    max_tokens=max_tokens,
+                    allow_iterative_reduction=allow_iterative_reduction,
+                )
+                self.assertEqual(trunc["text"], expected["text"])
+
+                if "tokens" in expected:
+                    expected_length = len(expected["tokens"]["input_ids"])
+                else:
+                    expected_length = expected["length"]
+                self.assertEqual(trunc["length"], expected_length)
+
+    def test_batch_truncate_text_at_center(self):
+        """
+        Test that the batched truncation gives the same texts and lengths as calling
+        truncate_text_at_center on each text.
+        """
+        self.check_same_as_truncate_text_at_center(allow_iterative_reduction=False)
+
+    def test_batch_truncate_text_at_center_iterative_reduction(self):
+        """
+        Test that, with allow_iterative_reduction, the batched truncation gives the same
+        texts and lengths as truncate_text_at_center, and that every truncated text fits
+        within its max_tokens, like with assert_max_tokens (where the retry without the
+        ellipsis is then never needed).
+        """
+        self.check_same_as_truncate_text_at_center(allow_iterative_reduction=True)
+
+        truncs = _batch_truncate_text_at_center(
+            self.texts,
+            self.max_tokens_list,
+            tokenizer=self.tokenizer,
+            allow_iterative_reduction=True,
+        )
+        for text, max_tokens, trunc in zip(self.texts, self.max_tokens_list, truncs):
+            self.assertLessEqual(trunc["length"], max_tokens)
+
+            expected = truncate_text_at_center(
+                text,
+                tokenizer=self.tokenizer,
+                max_tokens=max_tokens,
+                assert_max_tokens=True,
+                allow_iterative_reduction=True,
+            )
+            self.assertEqual(trunc["text"], expected["text"])
+
+    def test_batch_truncate_text_at_center_empty(self):
+        """
+        Test that an empty batch returns an empty list without calling the tokenizer.
+        """
+        self.assertEqual(_batch_truncate_text_at_center([], [], tokenizer=None), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from weblinx.utils.envs import get_env_dict, set_env_vars
+
+
+class TestGetEnvDict(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name, ".env")
+
+    def test_get_env_dict(self):
+        """
+        Test that blank lines and comments are skipped, that the lines are split at the
+        first "=" so values can contain "=", and that the values are stripped.
+        """
+        self.path.write_text(
+            "# a comment\n"
+            "\n"
+            "API_KEY=abc123\n"
+            "   \n"
+            "  # an indented comment\n"
+            "TOKEN=a=b==\n"
+            "URL=https://example.com/?q=1  \n"
+            "EMPTY=\n"
+        )
+
+        self.assertEqual(
+            get_env_dict(self.path),
+            {
+                "API_KEY": "abc123",
+                "TOKEN": "a=b==",
+                "URL": "https://example.com/?q=1",
+                "EMPTY": "",
+            },
+        )
+
+    def test_get_env_dict_invalid_line(self):
+        """
+        Test that a ValueError is raised for a line that is not a comment and has no "=".
+        """
+        self.path.write_text("API_KEY=abc123\nNOT_A_VARIABLE\n")
+
+        with self.assertRaises(ValueError):
+            get_env_dict(self.path)
+
+    def test_get_env_dict_missing_file(self):
+        """
+        Test that a FileNotFoundError is raised if the file does not exist.
+        """
+        with self.assertRaises(FileNotFoundError):
+            get_env_dict(Path(self.tmp_dir.name, "missing.env"))
+
+    def test_set_env_vars(self):
+        """
+        Test that the variables of the file are set in os.environ.
+        """
+        self.path.write_text("# a comment\nWEBLINX_TEST_VAR=a=b\n")
+
+        with patch.dict(os.environ):
+            set_env_vars(self.path)
+            self.assertEqual(os.environ["WEBLINX_TEST_VAR"], "a=b")
+
+        self.assertNotIn("WEBLINX_TEST_VAR", os.environ)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+
+import weblinx as wl
+from weblinx.utils.format import (
+    format_intent_automatically,
+    format_target_bbox,
+    format_turns,
+)
+
+
+def make_replay(turns_data):
+    return wl.Replay({"data": turns_data}, demo_name="demo", base_dir="/tmp")
+
+
+def make_click_turn(bbox):
+    element = {
+        "attributes": {"data-webtasks-id": "abc"},
+        "tagName": "BUTTON",
+        "textContent": "Submit",
+    }
+    if bbox is not None:
+        element["bbox"] = bbox
+
+    metadata = {
+        "url": "https://www.example.com/",
+        "viewportHeight": 700,
+        "viewportWidth": 1000,
+        "zoomLevel": 1,
+    }
+    return {
+        "type": "browser",
+        "timestamp": 1.0,
+        "action": {
+            "intent": "click",
+            "arguments": {"element": element, "metadata": metadata, "properties": {}},
+        },
+    }
+
+
+def make_turns():
+    metadata = {
+        "url": "https://www.example.com/",
+        "viewportHeight": 700,
+        "viewportWidth": 1000,
+        "zoomLevel": 1,
+    }
+    load_properties = {
+        "url": "https://www.example.com/page",
+        "transitionType": "link",
+        "transitionQualifiers": ["from_address_bar"],
+    }
+
+    def browser_turn(intent, timestamp, **arguments):
+        arguments["metadata"] = metadata
+        return {
+            "type": "browser",
+            "timestamp": timestamp,
+            "action": {"intent": intent, "arguments": arguments},
+        }
+
+    return [
+        {"type": "chat", "timestamp": 0.5, "speaker": "instructor", "utterance": "Hi"},
+        browser_turn("load", 1.0, properties=load_properties),
+        make_click_turn({"top": 1, "left": 2, "right": 30, "bottom": 40}),
+        browser_turn("scroll", 2.0, scrollX=0.0, scrollY=120.5),
+        browser_turn("tabswitch", 3.0, properties={"tabId": 2, "tabIdOrigin": 1}),
+        {"type": "chat", "timestamp": 4.0, "speaker": "navigator", "utterance": "Done"},
+    ]
+
+
+class TestFormatTargetBbox(unittest.TestCase):
+    def test_format_target_bbox_without_bbox(self):
+        """
+        Test that format_target_bbox returns the (-1, -1, -1, -1) bounding box when the
+        element of the turn has no bbox, or an empty one, instead of raising an error.
+        """
+        replay = make_replay([make_click_turn(None), make_click_turn({})])
+        expected = {"top": -1, "left": -1, "right": -1, "bottom": -1}
+
+        for turn in replay:
+            self.assertEqual(format_target_bbox(turn), expected)
+            self.assertEqual(
+                format_target_bbox(turn, return_as="str"),
+                "bounding_box(top=-1, left=-1, right=-1, bottom=-1)",
+            )
+
+    def test_format_target_bbox_with_bbox(self):
+        """
+        Test that format_target_bbox formats the four sides of the element's bbox with
+        the requested number of decimals.
+        """
+        bbox = {"top": 1.25, "left": 2.5, "right": 30.75, "bottom": 40.0}
+        turn = make_replay([make_click_turn(bbox)])[0]
+
+        self.assertEqual(
+            format_target_bbox(turn),
+            {"top": 1, "left": 2, "right": 30, "bottom": 40},
+        )
+        self.assertEqual(
+            format_target_bbox(turn, decimal=2, return_as="str"),
+            "bounding_box(top=1.25, left=2.5, right=30.75, bottom=40.0)",
+        )
+
+
+class TestFormatTurns(unittest.TestCase):
+    def test_format_turns_matches_format_intent_automatically(self):
+        """
+        Test that format_turns formats each turn (chat turns and browser turns of
+        different intents) like format_intent_automatically, as dicts and as strings.
+        """
+        replay = make_replay(make_turns())
+
+        for return_as in ["dict", "str"]:
+            with self.subTest(return_as=return_as):
+                expected = [
+                    format_intent_automatically(turn, return_as=return_as)
+                    for turn in replay
+                ]
+                self.assertEqual(format_turns(replay, return_as=return_as), expected)
+
+        self.assertEqual(format_turns([]), [])
+
+    def test_format_turns_unknown_intent(self):
+        """
+        Test that format_turns raises a ValueError for an unknown intent, like
+        format_intent_automatically.
+        """
+        turns = make_turns()
+        turns[1]["action"]["intent"] = "unknown"
+        replay = make_replay(turns)
+
+        with self.assertRaises(ValueError):
+            format_intent_automatically(replay[1])
+        with self.assertRaises(ValueError):
+            format_turns(replay)
+
+
+if __name__ == "__main__":
+    unittest.main()
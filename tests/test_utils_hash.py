@@ -0,0 +1,135 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import weblinx.utils
+from weblinx.utils import hash_file, hash_files, hash_tree
+
+
+def write_files(directory, sizes):
+    """
+    Writes one file of random bytes per size in `sizes`, and returns a dictionary
+    mapping each path to its content.
+    """
+    contents = {}
+    for i, size in enumerate(sizes):
+        path = str(Path(directory, f"file_{i}.bin"))
+        content = os.urandom(size)
+        Path(path).write_bytes(content)
+        contents[path] = content
+
+    return contents
+
+
+class TestHashFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_hash_files_matches_hashlib(self):
+        """
+        Test that hash_files returns the same digests as hashlib.md5 over the bytes of
+        each file, for empty, small and larger than one chunk files, and whether the
+        files are hashed in threads or sequentially.
+        """
+        sizes = [0, 1, 1000, (1 << 20) - 1, 1 << 20, 3 * (1 << 20) + 7]
+        contents = write_files(self.tmp_dir.name, sizes)
+        expected = {p: hashlib.md5(c).hexdigest() for p, c in contents.items()}
+
+        self.assertEqual(hash_files(list(contents), num_workers=4), expected)
+        self.assertEqual(hash_files(list(contents), num_workers=1), expected)
+
+    def test_hash_file_overlapped_matches_hashlib(self):
+        """
+        Test that files hashed with the overlapped reads (used for very large files)
+        have the same digests as hashlib.md5 over their bytes, including when the last
+        chunk is partial.
+        """
+        sizes = [(4 << 20) * 2, (4 << 20) * 2 + 12345]
+        contents = write_files(self.tmp_dir.name, sizes)
+
+        with patch.object(weblinx.utils, "_HASH_OVERLAP_MIN_SIZE", 1000):
+            for path, content in contents.items():
+                self.assertEqual(hash_file(path), hashlib.md5(content).hexdigest())
+
+    def test_hash_files_missing(self):
+        """
+        Test that a missing file raises a FileNotFoundError, or is mapped to None when
+        error_on_missing is False.
+        """
+        contents = write_files(self.tmp_dir.name, [10])
+        missing = str(Path(self.tmp_dir.name, "missing.bin"))
+        paths = list(contents) + [missing]
+
+        with self.assertRaises(FileNotFoundError):
+            hash_files(paths)
+
+        hashes = hash_files(paths, error_on_missing=False)
+        self.assertIsNone(hashes[missing])
+
+
+class TestHashTree(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def make_tree(self, name, files):
+        """
+        Creates the directory `name` with the given files (a list of relative path and
+        content pairs), in the order given, and returns its path.
+        """
+        root = Path(self.tmp_dir.name, name)
+        for rel_path, content in files:
+            path = root / rel_path
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+
+        return str(root)
+
+    def relative_hashes(self, root, **kwargs):
+        hashes = hash_tree(root, **kwargs)
+        return [(os.path.relpath(p, root), h) for p, h in hashes.items()]
+
+    def test_hash_tree_order_independent(self):
+        """
+        Test that hash_tree returns the same paths, in sorted order, and the same hashes
+        for two directories with the same files created in different orders, and that
+        repeated calls give the same result.
+        """
+        files = [(f"file_{i}.txt", f"content {i}".encode()) for i in range(20)]
+        files.append((os.path.join("sub", "nested.txt"), b"nested"))
+
+        root_a = self.make_tree("a", files)
+        root_b = self.make_tree("b", files[::-1])
+
+        hashes_a = self.relative_hashes(root_a, recursive=True)
+        hashes_b = self.relative_hashes(root_b, recursive=True)
+
+        self.assertEqual(hashes_a, hashes_b)
+        self.assertEqual(hashes_a, sorted(hashes_a))
+        self.assertEqual(self.relative_hashes(root_a, recursive=True), hashes_a)
+        self.assertEqual(
+            self.relative_hashes(root_a, recursive=True, num_workers=1), hashes_a
+        )
+        self.assertEqual(
+            dict(hashes_a),
+            {p: hashlib.md5(c).hexdigest() for p, c in files},
+        )
+
+    def test_hash_tree_not_recursive(self):
+        """
+        Test that the files in subdirectories are skipped unless recursive is True.
+        """
+        root = self.make_tree("a", [("top.txt", b"top"), ("sub/nested.txt", b"x")])
+
+        self.assertEqual(
+            self.relative_hashes(root),
+            [("top.txt", hashlib.md5(b"top").hexdigest())],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+from types import SimpleNamespace
+
+from weblinx.utils.html import has_elem_in_viewport, has_elems_in_viewport_batch
+
+
+def make_box(x, y, width, height):
+    return {"x": x, "y": y, "width": width, "height": height}
+
+
+def make_turn(bboxes, viewport_width=1000, viewport_height=700):
+    return SimpleNamespace(
+        index=0,
+        bboxes=bboxes,
+        viewport_width=viewport_width,
+        viewport_height=viewport_height,
+    )
+
+
+BBOXES = {
+    "inside": make_box(10, 20, 100, 50),
+    "right": make_box(1200, 20, 100, 50),
+    "below": make_box(10, 900, 100, 50),
+    "narrow": make_box(10, 20, 1, 50),
+    "flat": make_box(10, 20, 100, 1),
+    "empty": None,
+}
+
+ATTRIB_DICTS = [
+    {"data-webtasks-id": "inside"},
+    {"data-webtasks-id": "right"},
+    {"data-webtasks-id": "below"},
+    {"data-webtasks-id": "narrow", "class": "foo"},
+    {"data-webtasks-id": "flat"},
+    {"data-webtasks-id": "empty"},
+    {"data-webtasks-id": "missing"},
+    {"class": "no-id"},
+    {"data-other-id": "inside"},
+]
+
+
+class TestHasElemsInViewportBatch(unittest.TestCase):
+    def check_same_as_has_elem_in_viewport(self, turn, **kwargs):
+        expected = [
+            has_elem_in_viewport(turn, attrib_dict, **kwargs)
+            for attrib_dict in ATTRIB_DICTS
+        ]
+        self.assertEqual(
+            has_elems_in_viewport_batch(turn, ATTRIB_DICTS, **kwargs), expected
+        )
+
+        return expected
+
+    def test_has_elems_in_viewport_batch(self):
+        """
+        Test that the batched check gives the same result as has_elem_in_viewport for
+        each element, including elements without a bbox or without the id attribute.
+        """
+        expected = self.check_same_as_has_elem_in_viewport(make_turn(BBOXES))
+        self.assertEqual(
+            expected, [True, False, False, False, False, False, False, False, False]
+        )
+
+        self.check_same_as_has_elem_in_viewport(
+            make_turn(BBOXES), min_height=0, min_width=0
+        )
+        self.check_same_as_has_elem_in_viewport(make_turn(BBOXES), key="data-other-id")
+
+    def test_has_elems_in_viewport_batch_without_viewport(self):
+        """
+        Test that, when the viewport size is unknown, only the size of the elements
+        is checked, like in has_elem_in_viewport.
+        """
+        turn = make_turn(BBOXES, viewport_width=None, viewport_height=None)
+        expected = self.check_same_as_has_elem_in_viewport(turn)
+        self.assertEqual(expected[:3], [True, True, True])
+
+    def test_has_elems_in_viewport_batch_without_bboxes(self):
+        """
+        Test that all the elements are outside the viewport when the turn is None or
+        has no bboxes.
+        """
+        for turn in [None, make_turn(None)]:
+            expected = self.check_same_as_has_elem_in_viewport(turn)
+            self.assertEqual(expected, [False] * len(ATTRIB_DICTS))
+
+        self.assertEqual(has_elems_in_viewport_batch(make_turn(BBOXES), []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import random
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from weblinx.utils import get_nums_from_path, rank_paths, rank_paths_many
+
+
+def make_paths(num_paths, seed=0):
+    """
+    Generates shuffled paths of screenshots and pages, with some ties on the numbers
+    and some second numbers larger than 1.
+    """
+    rng = random.Random(seed)
+    paths = []
+    for _ in range(num_paths):
+        prefix = rng.choice(["screenshot", "page", "bboxes"])
+        ext = rng.choice([".png", ".html", ".json"])
+        num_1, num_2 = rng.randint(0, 50), rng.randint(0, 3)
+        paths.append(f"/data/demo/{prefix}-{num_1}-{num_2}{ext}")
+
+    return paths
+
+
+class TestRankPaths(unittest.TestCase):
+    def test_get_nums_from_path(self):
+        """
+        Test that the numbers are found in the file name, with or without a prefix,
+        directories or an extension, and for str and Path inputs.
+        """
+        self.assertEqual(get_nums_from_path("screenshot-15-1.png"), (15, 1))
+        self.assertEqual(get_nums_from_path("/a/b.c/page-15-1.html"), (15, 1))
+        self.assertEqual(get_nums_from_path(Path("a/page-3-12.html")), (3, 12))
+        self.assertEqual(get_nums_from_path("15-1"), (15, 1))
+        self.assertEqual(get_nums_from_path("some-page-15-1.html"), (15, 1))
+
+        with self.assertRaises(ValueError):
+            get_nums_from_path("screenshot.png")
+
+    def test_rank_paths_many(self):
+        """
+        Test that rank_paths_many returns the same ranks as rank_paths for each path,
+        and that sorting the paths by these ranks with a stable argsort gives the same
+        order as sorting them with rank_paths, including ties.
+        """
+        paths = make_paths(200)
+
+        for max_num_2 in [1, 3, 10]:
+            with self.subTest(max_num_2=max_num_2):
+                ranks = rank_paths_many(paths, max_num_2=max_num_2)
+                expected = [rank_paths(p, max_num_2=max_num_2) for p in paths]
+                self.assertEqual(ranks.tolist(), expected)
+
+                order = np.argsort(ranks, kind="stable")
+                self.assertEqual(
+                    [paths[i] for i in order],
+                    sorted(paths, key=lambda p: rank_paths(p, max_num_2=max_num_2)),
+                )
+
+    def test_rank_paths_many_empty(self):
+        """
+        Test that an empty list of paths gives an empty array of ranks.
+        """
+        ranks = rank_paths_many([])
+        self.assertEqual(ranks.shape, (0,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+
+from weblinx.utils import filter_records
+from weblinx.utils.recs import RecordIndex
+
+
+RECORDS = [
+    {"demo_name": "a", "turn_index": 0, "split": "train"},
+    {"demo_name": "a", "turn_index": 1, "split": "train"},
+    {"demo_name": "b", "turn_index": 0, "split": "valid"},
+    {"demo_name": "a", "turn_index": 0, "split": "test"},
+    {"demo_name": "c"},
+]
+
+
+class TestFilterRecords(unittest.TestCase):
+    def test_filter_records_multiple_keys(self):
+        """
+        Test that filter_records keeps only the records matching all the given keys,
+        in the same order as in the input records.
+        """
+        self.assertEqual(
+            filter_records(RECORDS[:4], demo_name="a", turn_index=0),
+            [RECORDS[0], RECORDS[3]],
+        )
+        self.assertEqual(
+            filter_records(RECORDS[:4], demo_name="a", turn_index=0, split="test"),
+            [RECORDS[3]],
+        )
+        self.assertEqual(filter_records(RECORDS[:4], demo_name="b", turn_index=1), [])
+
+    def test_filter_records_first_key_mismatch(self):
+        """
+        Test that a record that does not match the first key is skipped without
+        looking up the later keys, so it does not need to have them.
+        """
+        self.assertEqual(
+            filter_records(RECORDS, demo_name="b", turn_index=0),
+            [RECORDS[2]],
+        )
+
+    def test_filter_records_missing_key(self):
+        """
+        Test that a KeyError is raised when a record needs to be compared on a key
+        that it does not have.
+        """
+        with self.assertRaises(KeyError):
+            filter_records(RECORDS, demo_name="c", turn_index=0)
+
+        with self.assertRaises(KeyError):
+            filter_records(RECORDS, turn_index=0)
+
+    def test_filter_records_no_kwargs(self):
+        """
+        Test that all the records are returned, as a new list, when no kwargs are given.
+        """
+        filtered = filter_records(RECORDS)
+        self.assertEqual(filtered, RECORDS)
+        self.assertIsNot(filtered, RECORDS)
+
+
+class TestRecordIndex(unittest.TestCase):
+    def test_record_index_matches_filter_records(self):
+        """
+        Test that RecordIndex.filter returns the same records as filter_records, for
+        indexed keys, non-indexed keys and a mix of both.
+        """
+        records = RECORDS[:4]
+        index = RecordIndex(records, keys=["demo_name", "turn_index"])
+        queries = [
+            {},
+            {"demo_name": "a"},
+            {"turn_index": 0},
+            {"demo_name": "a", "turn_index": 0},
+            {"demo_name": "a", "turn_index": 1},
+            {"demo_name": "b", "turn_index": 1},
+            {"demo_name": "a", "turn_index": 0, "split": "test"},
+            {"split": "valid"},
+            {"demo_name": "missing"},
+        ]
+
+        for kwargs in queries:
+            with self.subTest(kwargs=kwargs):
+                self.assertEqual(
+                    index.filter(**kwargs), filter_records(records, **kwargs)
+                )
+
+    def test_record_index_first_key_mismatch(self):
+        """
+        Test that a record missing a non-indexed key is skipped without error when it
+        does not match the indexed keys.
+        """
+        index = RecordIndex(RECORDS, keys=["demo_name"])
+        self.assertEqual(index.filter(demo_name="b", turn_index=0), [RECORDS[2]])
+
+    def test_record_index_missing_key(self):
+        """
+        Test that a KeyError is raised when a record does not have one of the keys
+        to index, or a non-indexed key it needs to be compared on.
+        """
+        with self.assertRaises(KeyError):
+            RecordIndex(RECORDS, keys=["demo_name", "turn_index"])
+
+        index = RecordIndex(RECORDS, keys=["demo_name"])
+        with self.assertRaises(KeyError):
+            index.filter(demo_name="c", turn_index=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from weblinx.utils.url import shorten_url
+
+
+class TestShortenUrl(unittest.TestCase):
+    def test_shorten_url_fits_width(self):
+        """
+        Test that a url longer than the width is shortened to at most `width` characters,
+        keeping the start of the url and ending with the placeholder.
+        """
+        url = "https://www.example.com/some/very/long/path/to/a/page?query=1"
+        shortened = shorten_url(url, width=20)
+
+        self.assertLessEqual(len(shortened), 20)
+        self.assertTrue(shortened.endswith("[...]"))
+        self.assertTrue(url.startswith(shortened[: -len("[...]")]))
+
+    def test_shorten_url_unchanged(self):
+        """
+        Test that a url that already fits within the width is returned as is.
+        """
+        url = "https://example.com"
+        self.assertEqual(shorten_url(url, width=20), url)
+        self.assertEqual(shorten_url(url, width=len(url)), url)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -457,10 +457,11 @@ def auto_eval_and_save(
 
             # res_md5 = hashlib.md5(ujson.dumps(model_results).encode()).hexdigest()
             res_md5 = __wl_utils.hash_json(model_results, "md5")
-            score_md5 = __wl_utils.hash_file(score_path, "md5", error_on_missing=False)
-            processed_md5 = __wl_utils.hash_file(
-                processed_path, "md5", error_on_missing=False
+            file_md5s = __wl_utils.hash_files(
+                [score_path, processed_path], "md5", error_on_missing=False
             )
+            score_md5 = file_md5s[score_path]
+            processed_md5 = file_md5s[processed_path]
 
             if (
                 check_hashes
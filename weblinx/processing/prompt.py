@@ -1,16 +1,29 @@
+import bisect
 from functools import partial
+from operator import itemgetter
 from multiprocessing.pool import Pool, ThreadPool
 import json
 import logging
 import math
-from typing import TYPE_CHECKING, Callable, List
+from typing import TYPE_CHECKING, Callable, List, NamedTuple
 
+import numpy as np
 from tqdm.auto import tqdm
 
-from .. import filter_turns, Turn, Replay
-from ..utils.recs import get_list_from_records_by_key
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from .. import Turn, Replay
 from ..utils.format import format_output_dictionary, format_timestamp
-from .truncation import reduce_list_of_lengths, truncate_text_at_center
+from .truncation import (
+    get_num_tokens,
+    get_num_tokens_in_batch,
+    get_num_tokens_of_constant,
+    reduce_list_of_lengths,
+    truncate_text_at_center,
+)
 
 
 if TYPE_CHECKING:
@@ -154,7 +167,7 @@ def format_candidates(candidates, max_char_len=300, use_uid_as_rank=False):
     str
         The candidates formatted as a string.
     """
-    s = ""
+    parts = []
     for cand in candidates:
         doc = cand["doc"].replace("\n", " ")
         if use_uid_as_rank:
@@ -165,8 +178,27 @@ def format_candidates(candidates, max_char_len=300, use_uid_as_rank=False):
         if max_char_len is not None and len(doc) > max_char_len:
             doc = doc[: max_char_len - 3] + "..."
 
-        s += f"({rank}) {doc}\n"
-    return s
+        parts.append(f"({rank}) {doc}\n")
+    return "".join(parts)
+
+
+class _TurnMap(dict):
+    """
+    Mapping for `str.format_map` that looks up the values of a turn on demand, so that
+    the turn does not need to be copied into a new dictionary every time it is formatted.
+    If `convert_to_minutes` is True, the timestamp is formatted with `format_timestamp`.
+    """
+
+    def __init__(self, turn, convert_to_minutes=True):
+        super().__init__()
+        self.turn = turn
+        self.convert_to_minutes = convert_to_minutes
+
+    def __missing__(self, key):
+        if key == "timestamp" and self.convert_to_minutes:
+            return format_timestamp(self.turn, return_as=str)
+
+        return self.turn[key]
 
 
 def format_utterances(
@@ -226,10 +258,7 @@ def format_utterances(
 
     texts = []
     for turn in selected_turns:
-        turn_dict = {k: v for k, v in turn.items()}
-        if convert_to_minutes:
-            turn_dict["timestamp"] = format_timestamp(turn, return_as=str)
-        texts.append(template.format(**turn_dict))
+        texts.append(template.format_map(_TurnMap(turn, convert_to_minutes)))
 
     if sep is None:
         utterance_context = texts
@@ -239,6 +268,19 @@ def format_utterances(
     return utterance_context
 
 
+class _TruncationRecord(NamedTuple):
+    """
+    A value (or utterance) to truncate, with its number of tokens. For the values of the
+    previous turns, `key` and `original_value_type` are used to put the truncated value back.
+    """
+
+    index: int
+    text: str
+    length: int
+    key: str = None
+    original_value_type: type = None
+
+
 def format_prev_turns_truncated(
     replay: "Replay",
     turn: "Turn",
@@ -249,13 +291,29 @@ def format_prev_turns_truncated(
     num_prev_turns: int = 5,
     turn_sep: str = " ; ",
     allow_iterative_reduction=False,
+    json_backend="json",
 ):
     """
     This performs the same function as `format_prev_turns`, but it truncates the text
     to fit within the `max_tokens`. The truncation is not a regular truncation, instead
     it uses the `truncate_text_at_center` function (see strategic trunction part
     in the paper).
+
+    `json_backend` is used to serialize list and dict values before truncating them, and
+    can be either 'json' or 'orjson'. 'orjson' is faster, but it does not add spaces after
+    the separators, so the prompts will be different from the ones obtained with 'json'.
     """
+    if json_backend not in ("json", "orjson"):
+        raise ValueError(
+            f"Invalid json_backend '{json_backend}'. Must be either 'json' or 'orjson'"
+        )
+
+    if json_backend == "orjson" and orjson is None:
+        raise ImportError(
+            "orjson is not installed. Please change your json backend or install "
+            "it with `pip install orjson`"
+        )
+
     start_index = max(0, turn.index - num_prev_turns)
     prev_turns = replay[start_index : turn.index]
     prev_turns_lst = [format_intent(turn, return_as=dict) for turn in prev_turns]
@@ -272,7 +330,7 @@ def format_prev_turns_truncated(
         else:
             return prev_turns_fmt_lst
 
-    records = []
+    values = []
 
     for t, turn_formatted in enumerate(prev_turns_lst):
         for key, value in turn_formatted.items():
@@ -285,41 +343,54 @@ def format_prev_turns_truncated(
             if isinstance(value, (int, float)):
                 value_str = str(value)
             elif isinstance(value, (list, dict)):
-                value_str = json.dumps(value)
+                if json_backend == "orjson":
+                    value_str = orjson.dumps(
+                        value, option=orjson.OPT_NON_STR_KEYS
+                    ).decode("utf-8")
+                else:
+                    value_str = json.dumps(value)
             else:
                 value_str = value
 
-            tokens = tokenizer.tokenize(value_str, add_special_tokens=False)
-
-            records.append(
-                {
-                    "index": t,
-                    "key": key,
-                    "text": value_str,
-                    "turn_formatted": turn_formatted,
-                    "original_value_type": type(value),
-                    "tokens": tokens,
-                    "length": len(tokens),
-                }
-            )
+            values.append((t, key, value_str, type(value)))
+
+    # Count the tokens of all the values at once, rather than one value at a time
+    lengths = get_num_tokens_in_batch(tokenizer, [v[2] for v in values])
+    records = [
+        _TruncationRecord(
+            index=t,
+            text=value_str,
+            length=length,
+            key=key,
+            original_value_type=value_type,
+        )
+        for (t, key, value_str, value_type), length in zip(values, lengths)
+    ]
 
     # Note: We only count the token lengths of the values, not the entire formatted string
     # The full string may have additional tokens (key, separator, etc.)
     # Consequently, max_total_length is different from max_tokens
-    records = sorted(records, key=lambda r: r["length"])
-    lengths_orig = get_list_from_records_by_key(records, "length")
-    max_total_length = sum(lengths_orig) - num_tokens_to_remove
-    lengths_reduced = reduce_list_of_lengths(lengths_orig, max_length=max_total_length)
+    lengths_arr = np.fromiter(
+        (r.length for r in records), dtype=np.int32, count=len(records)
+    )
+    # Stable sort so that records with the same length keep their original order
+    order = np.argsort(lengths_arr, kind="stable")
+    sorted_lengths = lengths_arr[order]
+    max_total_length = int(sorted_lengths.sum()) - num_tokens_to_remove
+    lengths_reduced = reduce_list_of_lengths(
+        sorted_lengths.tolist(), max_length=max_total_length
+    )
 
-    for i, r in enumerate(records):
+    for i, j in enumerate(order):
+        r = records[j]
         red_length = lengths_reduced[i]
         # If the length is the same, then we don't need to do anything
-        if red_length >= r["length"]:
+        if red_length >= r.length:
             continue
 
         # Otherwise, we need to truncate the text
         trunc = truncate_text_at_center(
-            r["text"],
+            r.text,
             tokenizer=tokenizer,
             max_tokens=red_length,
             allow_iterative_reduction=allow_iterative_reduction,
@@ -328,8 +399,8 @@ def format_prev_turns_truncated(
         if trunc["text"] is None:
             trunc["text"] = ""
 
-        if r["original_value_type"] in (int, float):
-            cls_ = r["original_value_type"]
+        if r.original_value_type in (int, float):
+            cls_ = r.original_value_type
 
             # Let's try to convert the value back to its original type.
             # If there's a problem converting the value, then we will not change it back
@@ -338,7 +409,7 @@ def format_prev_turns_truncated(
             except ValueError:
                 pass
 
-        prev_turns_lst[r["index"]][r["key"]] = trunc["text"]
+        prev_turns_lst[r.index][r.key] = trunc["text"]
 
     formatted = [format_output_dict_fn(turn) for turn in prev_turns_lst]
 
@@ -383,6 +454,7 @@ def multi_attempt_format_prev_turns_truncated(
     format_output_dict_fn: Callable = format_output_dictionary,
     warn_after_attempts: bool = True,
     allow_iterative_reduction=False,
+    json_backend="json",
 ):
     """
     This function behaves the same as `format_prev_turns_truncated`, but it will attempt to
@@ -390,7 +462,8 @@ def multi_attempt_format_prev_turns_truncated(
     when the object is difficult to truncate, and the function is unable to truncate the text
     using the approximation method described in the strategic truncation part of the paper.
     """
-    prev_turns_tokens = tokenizer.tokenize(
+    num_tokens = get_num_tokens(
+        tokenizer,
         format_prev_turns_truncated(
             replay=replay,
             turn=turn,
@@ -400,12 +473,12 @@ def multi_attempt_format_prev_turns_truncated(
             num_prev_turns=num_prev_turns,
             format_output_dict_fn=format_output_dict_fn,
             turn_sep=turn_sep if turn_sep is not None else " ; ",
+            json_backend=json_backend,
         ),
-        add_special_tokens=False,
     )
 
     for _ in range(max_attempts):
-        num_tokens_to_remove = len(prev_turns_tokens) - max_tokens
+        num_tokens_to_remove = num_tokens - max_tokens
 
         prev_turns_formatted = format_prev_turns_truncated(
             replay=replay,
@@ -416,23 +489,23 @@ def multi_attempt_format_prev_turns_truncated(
             num_prev_turns=num_prev_turns,
             format_output_dict_fn=format_output_dict_fn,
             turn_sep=turn_sep,
+            json_backend=json_backend,
         )
+
         if isinstance(prev_turns_formatted, list):
             prev_turns_formatted_str = " ; ".join(prev_turns_formatted)
         else:
             prev_turns_formatted_str = prev_turns_formatted
 
-        prev_turns_tokens = tokenizer.tokenize(
-            prev_turns_formatted_str, add_special_tokens=False
-        )
+        num_tokens = get_num_tokens(tokenizer, prev_turns_formatted_str)
 
-        if max_tokens is None or (len(prev_turns_tokens) <= max_tokens):
+        if max_tokens is None or (num_tokens <= max_tokens):
             return prev_turns_formatted
 
     if warn_after_attempts:
         logging.warning(
             f"Reached max # of attempts to truncate prev_turns "
-            f"for demo {turn.demo_name}@{turn.index} (last: {len(prev_turns_tokens)} -> {max_tokens})"
+            f"for demo {turn.demo_name}@{turn.index} (last: {num_tokens} -> {max_tokens})"
         )
 
     # We will try to truncate the text directly
@@ -445,7 +518,7 @@ def multi_attempt_format_prev_turns_truncated(
         )
         prev_turns_formatted = trunc["text"]
     else:
-        num_turn_sep_tokens = len(tokenizer.tokenize(" ; ", add_special_tokens=False))
+        num_turn_sep_tokens = get_num_tokens_of_constant(tokenizer, " ; ")
         # We will truncate each turn individually up to the max_tokens, removing turns
         # until we are able to fit the turns into the max_tokens
 
@@ -460,8 +533,9 @@ def multi_attempt_format_prev_turns_truncated(
                 allow_iterative_reduction=allow_iterative_reduction,
             )
             prev_turns_formatted[i] = trunc["text"]
-            tokens = tokenizer.tokenize(trunc["text"], add_special_tokens=False)
-            num_tokens_remaining -= len(tokens) + num_turn_sep_tokens
+            num_tokens_remaining -= (
+                get_num_tokens(tokenizer, trunc["text"]) + num_turn_sep_tokens
+            )
             num_turns_remaining -= 1
 
     return prev_turns_formatted
@@ -501,43 +575,50 @@ def format_utterances_truncated(
     else:
         utterances_str = str(sep).join(utterances)
 
-    utter_tokens = tokenizer.tokenize(utterances_str, add_special_tokens=False)
-    num_tokens_to_remove = len(utter_tokens) - max_tokens
-
-    records = []
-    for i, text in enumerate(utterances):
-        tokens = tokenizer.tokenize(text, add_special_tokens=False)
-        records.append(
-            {
-                "index": i,
-                "text": text,
-                "tokens": tokens,
-                "length": len(tokens),
-            }
-        )
+    num_tokens_to_remove = get_num_tokens(tokenizer, utterances_str) - max_tokens
+
+    # If the utterances already fit, we don't need to tokenize them individually
+    if num_tokens_to_remove <= 0:
+        if sep is None:
+            return utterances
+        else:
+            return sep.join(utterances)
+
+    lengths = get_num_tokens_in_batch(tokenizer, utterances)
+    records = [
+        _TruncationRecord(index=i, text=text, length=length)
+        for i, (text, length) in enumerate(zip(utterances, lengths))
+    ]
 
     # Note: We only count the token lengths of the values, not the entire formatted string
     # The full string may have additional tokens (key, separator, etc.)
     # Consequently, max_total_length is different from max_tokens
-    records = sorted(records, key=lambda r: r["length"])
-    lengths_orig = get_list_from_records_by_key(records, "length")
-    max_total_length = sum(lengths_orig) - num_tokens_to_remove
-    lengths_reduced = reduce_list_of_lengths(lengths_orig, max_length=max_total_length)
+    lengths_arr = np.fromiter(
+        (r.length for r in records), dtype=np.int32, count=len(records)
+    )
+    # Stable sort so that records with the same length keep their original order
+    order = np.argsort(lengths_arr, kind="stable")
+    sorted_lengths = lengths_arr[order]
+    max_total_length = int(sorted_lengths.sum()) - num_tokens_to_remove
+    lengths_reduced = reduce_list_of_lengths(
+        sorted_lengths.tolist(), max_length=max_total_length
+    )
 
-    for i, rec in enumerate(records):
+    for i, j in enumerate(order):
+        rec = records[j]
         red_length = lengths_reduced[i]
         # If the length is the same, then we don't need to do anything
-        if red_length >= rec["length"]:
+        if red_length >= rec.length:
             continue
         # Otherwise, we need to truncate the text
         trunc = truncate_text_at_center(
-            rec["text"],
+            rec.text,
             tokenizer=tokenizer,
             max_tokens=red_length,
             allow_iterative_reduction=allow_iterative_reduction,
         )
 
-        utterances[rec["index"]] = trunc["text"]
+        utterances[rec.index] = trunc["text"]
 
     if sep is None:
         return utterances
@@ -579,7 +660,42 @@ def find_prev_turn_with_candidates(prev_turns, candidates, reverse=True):
     return None
 
 
-def select_candidates_for_turn(candidates, turn, num_candidates=20):
+def prepare_candidates(candidates):
+    """
+    This will sort the candidates of each turn by their rank and remove duplicates by uid
+    (keeping the highest ranked one), so that they only need to be processed once rather
+    than every time `select_candidates_for_turn` is called. The input is not modified.
+
+    Parameters
+    ----------
+    candidates : dict
+        The candidates for all turns, as a dictionary of lists.
+
+    Returns
+    -------
+    dict
+        A new dictionary with the same keys, where each list of candidates is sorted
+        by rank and deduplicated by uid. If `candidates` is None, then None is returned.
+    """
+    if candidates is None:
+        return None
+
+    prepared = {}
+    for key, cands in candidates.items():
+        # Remove duplicates by uid in a single pass, keeping the highest ranked candidate
+        # (the first one in case of ties), and only sort the remaining candidates
+        best = {}
+        for pos, cand in enumerate(cands):
+            cur = best.get(cand["uid"])
+            if cur is None or cand["rank"] < cur[0]:
+                best[cand["uid"]] = (cand["rank"], pos, cand)
+
+        prepared[key] = [c for _, _, c in sorted(best.values(), key=itemgetter(0, 1))]
+
+    return prepared
+
+
+def select_candidates_for_turn(candidates, turn, num_candidates=20, presorted=False):
     """
     This will select the top candidates for the given turn. The candidates are sorted by their rank,
     and the top `num_candidates` will be returned.
@@ -595,6 +711,10 @@ def select_candidates_for_turn(candidates, turn, num_candidates=20):
     num_candidates : int, optional
         The number of candidates to select. Defaults to 20.
 
+    presorted : bool, optional
+        Whether the candidates were already sorted and deduplicated with `prepare_candidates`,
+        in which case the top candidates are simply sliced. Defaults to False.
+
     Returns
     -------
     list
@@ -608,26 +728,21 @@ def select_candidates_for_turn(candidates, turn, num_candidates=20):
 
     key = (turn.demo_name, turn.index)
 
-    if key in candidates:
-        cands_turn = sorted(candidates[key], key=lambda c: c["rank"])
-        # Remove duplicates by uid
-        cands_turn_dedup = []
-        seen = set()
-        for cand in cands_turn:
-            if cand["uid"] not in seen:
-                cands_turn_dedup.append(cand)
-                seen.add(cand["uid"])
-
-        return cands_turn_dedup[:num_candidates]
-    else:
+    if key not in candidates:
         return None
 
+    if presorted:
+        return candidates[key][:num_candidates]
+
+    return prepare_candidates({key: candidates[key]})[key][:num_candidates]
+
 
 def select_turns_and_candidates_for_prompts(
     demos,
     candidates=None,
     num_candidates=20,
     remove_turns_without_elements=True,
+    num_threads=None,
 ):
     """
     This will select the turns that will be used for building the prompts. It first filters
@@ -651,6 +766,11 @@ def select_turns_and_candidates_for_prompts(
     remove_turns_without_elements : bool, optional
         Whether to remove turns that do not have elements. Defaults to True.
 
+    num_threads : int, optional
+        The number of threads used to load the replays of the demonstrations from disk,
+        before the turns are selected. If None or 1, the replays are loaded one at a time
+        as they are processed, rather than all at once. Defaults to None.
+
     Returns
     -------
     list
@@ -660,9 +780,23 @@ def select_turns_and_candidates_for_prompts(
         - cands_turn: The candidates for the turn, or None if no candidates are found
 
     """
+    # Sort and deduplicate the candidates once, rather than every time they are selected
+    candidates = prepare_candidates(candidates)
+
+    demos = list(demos)
+
+    # Loading the replays is I/O bound, so if requested we load them all first with
+    # threads (which keeps all of them in memory), then select the turns in a single loop
+    if num_threads is not None and num_threads > 1:
+        with ThreadPool(num_threads) as pool:
+            replays = pool.map(Replay.from_demonstration, demos)
+    else:
+        replays = map(Replay.from_demonstration, demos)
+
     turn_recs_for_building_prompt = []
-    for demo in tqdm(demos, desc="Processing demos into input records"):
-        replay = Replay.from_demonstration(demo)
+    for replay in tqdm(
+        replays, desc="Processing demos into input records", total=len(demos)
+    ):
         turns = replay.filter_by_intents(
             "click", "change", "textInput", "scroll", "load", "say", "submit"
         )
@@ -670,40 +804,47 @@ def select_turns_and_candidates_for_prompts(
             if turn.type == "chat" and not turn.has_screenshot():
                 replay.assign_screenshot_to_turn(turn)
 
-        turns = filter_turns(
-            turns, lambda t: t.has_screenshot() and t.get_screenshot_status() == "good"
-        )
-        turns = filter_turns(
-            turns,
-            lambda turn: not (
-                turn.type == "chat" and turn.get("speaker") != "navigator"
-            ),
-        )
-        # Remove click and textinput turns where element is None
-        if remove_turns_without_elements:
-            turns = filter_turns(
-                turns,
-                lambda turn: not (
-                    turn.intent in ("click", "change", "textinput", "submit")
-                    and turn.element is None
-                ),
+        # Keep turns with a good screenshot, remove chat turns that are not by the navigator,
+        # and remove click and textinput turns where element is None, in a single pass
+        turns = [
+            turn
+            for turn in turns
+            if turn.has_screenshot()
+            and turn.get_screenshot_status() == "good"
+            and not (turn.type == "chat" and turn.get("speaker") != "navigator")
+            and not (
+                remove_turns_without_elements
+                and turn.intent in ("click", "change", "textinput", "submit")
+                and turn.element is None
             )
+        ]
+
+        if candidates is not None:
+            # The selected turns that have candidates, along with their indices (which are
+            # sorted since turns are in order), so we can binary search for the previous
+            # turn with candidates instead of scanning all the previous turns
+            turns_with_cands = [
+                t for t in turns if (t.demo_name, t.index) in candidates
+            ]
+            indices_with_cands = [t.index for t in turns_with_cands]
 
-        for i, turn in enumerate(turns):
+        for turn in turns:
             if candidates is None:
                 cands_turn = None
             else:
                 cands_turn = select_candidates_for_turn(
-                    candidates, turn, num_candidates=num_candidates
+                    candidates, turn, num_candidates=num_candidates, presorted=True
                 )
                 # If we did not find any candidates for the current turn,
                 # then we need to find the previous turn that has candidates
                 if cands_turn is None:
-                    prev_turn = find_prev_turn_with_candidates(
-                        prev_turns=turns[:i], candidates=candidates
-                    )
+                    j = bisect.bisect_left(indices_with_cands, turn.index) - 1
+                    prev_turn = turns_with_cands[j] if j >= 0 else None
                     cands_turn = select_candidates_for_turn(
-                        candidates, prev_turn, num_candidates=num_candidates
+                        candidates,
+                        prev_turn,
+                        num_candidates=num_candidates,
+                        presorted=True,
                     )
 
             if cands_turn is None:
@@ -727,6 +868,7 @@ def build_input_record_for_single_turn(
     format_intent,
     build_prompt_records_fn,
     format_prompt_records_fn,
+    format_output_dict_fn=None,
 ):
     """
     This builds the input record for a single turn. The input record is a dictionary, which contains
@@ -757,6 +899,13 @@ def build_input_record_for_single_turn(
     format_prompt_records_fn : Callable
         A function that takes the prompt records and formats them.
 
+    format_output_dict_fn : Callable, optional
+        A function that formats the output of `format_intent(turn, return_as=dict)` as a string,
+        e.g. `partial(format_output_dictionary, function_key="intent")`. If given, the string
+        target is derived from the dictionary target rather than by calling `format_intent`
+        a second time, so it must give the same result as `format_intent(turn, return_as=str)`.
+        Defaults to None.
+
     Returns
     -------
     dict
@@ -777,13 +926,19 @@ def build_input_record_for_single_turn(
     else:
         prompt_fmt = format_prompt_records_fn(prompt_recs)
 
+    output_target_dict = format_intent(turn, return_as=dict)
+    if format_output_dict_fn is None:
+        output_target = format_intent(turn, return_as=str)
+    else:
+        output_target = format_output_dict_fn(output_target_dict)
+
     return {
         "demo_name": turn.demo_name,
         "base_dir": turn.base_dir,
         "turn_index": turn.index,
         "prompt": prompt_fmt,
-        "output_target": format_intent(turn, return_as=str),
-        "output_target_dict": format_intent(turn, return_as=dict),
+        "output_target": output_target,
+        "output_target_dict": output_target_dict,
         "use_candidates": cands_turn is not None,
         "screenshot_path": turn.get_screenshot_path(),
     }
@@ -794,6 +949,8 @@ def build_input_records_from_selected_turns(
     format_intent,
     build_prompt_records_fn,
     format_prompt_records_fn,
+    format_output_dict_fn=None,
+    output_path=None,
 ):
     """
     This will build the input records for the model. The input records are a list of dictionaries,
@@ -821,23 +978,116 @@ def build_input_records_from_selected_turns(
     format_prompt_records_fn : Callable
         A function that takes the prompt records and formats them.
 
+    format_output_dict_fn : Callable, optional
+        A function that formats the dictionary output of `format_intent` as a string. If given,
+        it is used to build the string target from the dictionary target instead of calling
+        `format_intent` again. See `build_input_record_for_single_turn`. Defaults to None.
+
+    output_path : str, optional
+        If given, each input record is written to this file as a line of JSON as soon as it
+        is built, instead of keeping all the records in memory. Defaults to None.
+
     Returns
     -------
-    list
-        A list of input records for the model.
+    list or int
+        A list of input records for the model, or the number of records written to
+        `output_path` if it is given.
     """
-    input_records = []
-    for selected_turn_dict in tqdm(selected_turns, desc="Building input records"):
-        rec = build_input_record_for_single_turn(
+    input_records = (
+        build_input_record_for_single_turn(
             turn_dict=selected_turn_dict,
             format_intent=format_intent,
             build_prompt_records_fn=build_prompt_records_fn,
             format_prompt_records_fn=format_prompt_records_fn,
+            format_output_dict_fn=format_output_dict_fn,
+        )
+        for selected_turn_dict in _records_progress_bar(
+            selected_turns, desc="Building input records"
         )
+    )
 
-        input_records.append(rec)
+    if output_path is not None:
+        return _write_records_to_jsonl(input_records, output_path)
 
-    return input_records
+    return list(input_records)
+
+
+def _records_progress_bar(iterable, desc, total=None):
+    """
+    Progress bar for the loops building the input records. Building a record can take less
+    than a millisecond, so the bar is refreshed at most twice per second and about every
+    0.1% of the records, rather than after every record.
+    """
+    if total is None and hasattr(iterable, "__len__"):
+        total = len(iterable)
+
+    return tqdm(
+        iterable,
+        desc=desc,
+        total=total,
+        mininterval=0.5,
+        miniters=max(1, (total or 0) // 1000),
+        smoothing=0.1,
+    )
+
+
+def _write_records_to_jsonl(records, output_path):
+    """
+    Writes each record of the `records` iterable as a line of JSON in `output_path`, and
+    returns the number of records written.
+    """
+    num_records = 0
+    with open(output_path, "w", buffering=1 << 20) as f:
+        for rec in records:
+            f.write(json.dumps(rec) + "\n")
+            num_records += 1
+
+    return num_records
+
+
+def _restore_order(indexed_records):
+    """
+    Yields the records of an iterable of (index, record) pairs in the order of their index.
+    Only the records that arrive before their turn are kept in memory.
+    """
+    pending = {}
+    next_index = 0
+    for index, rec in indexed_records:
+        pending[index] = rec
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+
+# Keyword arguments of `build_input_record_for_single_turn`, set in each worker process of
+# `build_input_records_from_selected_turns_parallel` by `_init_build_input_record_worker`
+_worker_build_kwargs = None
+
+
+def _init_build_input_record_worker(
+    format_intent,
+    build_prompt_records_fn,
+    format_prompt_records_fn,
+    format_output_dict_fn=None,
+):
+    global _worker_build_kwargs
+
+    _worker_build_kwargs = {
+        "format_intent": format_intent,
+        "build_prompt_records_fn": build_prompt_records_fn,
+        "format_prompt_records_fn": format_prompt_records_fn,
+        "format_output_dict_fn": format_output_dict_fn,
+    }
+
+
+def _build_input_record_in_worker(indexed_turn_dict, build_kwargs=None):
+    # The index is returned with the record so the order can be restored, since the
+    # records are received in the order they are completed
+    if build_kwargs is None:
+        build_kwargs = _worker_build_kwargs
+
+    index, turn_dict = indexed_turn_dict
+    return index, build_input_record_for_single_turn(turn_dict, **build_kwargs)
 
 
 def build_input_records_from_selected_turns_parallel(
@@ -847,6 +1097,11 @@ def build_input_records_from_selected_turns_parallel(
     format_prompt_records_fn,
     num_processes=4,
     chunksize=50,
+    format_output_dict_fn=None,
+    preserve_order=True,
+    maxtasksperchild=1000,
+    backend="process",
+    output_path=None,
 ):
     """
     This will build the input records for the model. The input records are a list of dictionaries,
@@ -882,43 +1137,124 @@ def build_input_records_from_selected_turns_parallel(
     chunksize : int, optional
         The chunksize to use for multiprocessing. Defaults to 50. This allows the processes to work
         on a chunk of `chunksize` turns at a time instead of one turn at a time, allowing for better
-        performance.
+        performance. If None, it is set so that each process receives about 4 chunks.
+
+    format_output_dict_fn : Callable, optional
+        A function that formats the dictionary output of `format_intent` as a string. If given,
+        it is used to build the string target from the dictionary target instead of calling
+        `format_intent` again. See `build_input_record_for_single_turn`. Defaults to None.
+
+    preserve_order : bool, optional
+        Whether to return the input records in the same order as `selected_turns`. The records
+        are received from the processes as soon as they are ready, so if this is False, they
+        are returned in that order instead. Defaults to True.
+
+    maxtasksperchild : int, optional
+        The number of chunks a process completes before it is replaced by a new one, which
+        bounds the memory used by long-running processes. If None, processes are never
+        replaced. Defaults to 1000. Only used with the 'process' backend.
+
+    backend : str, optional
+        Either 'process' to build the records in separate processes, or 'thread' to build
+        them in threads of the current process. Threads do not need to copy the functions
+        and the tokenizer to each worker, and fast tokenizers release the GIL while
+        tokenizing, but the rest of the work is limited by the GIL. Defaults to 'process'.
+
+    output_path : str, optional
+        If given, each input record is written to this file as a line of JSON as soon as it
+        is received, instead of keeping all the records in memory. With `preserve_order`,
+        records that arrive early are kept in memory until all the records before them have
+        been written. Defaults to None.
 
     Returns
     -------
-    list
-        A list of input records for the model.
+    list or int
+        A list of input records for the model, or the number of records written to
+        `output_path` if it is given.
     """
+    if backend not in ("process", "thread"):
+        raise ValueError(
+            f"Invalid backend '{backend}'. Must be either 'process' or 'thread'"
+        )
+
     # We want to still use tqdm to show the progress bar, so we will use the
     # multiprocessing.Pool.imap_unordered function, which returns an iterator
+    input_records = []
 
-    func = partial(
-        build_input_record_for_single_turn,
-        format_intent=format_intent,
-        build_prompt_records_fn=build_prompt_records_fn,
-        format_prompt_records_fn=format_prompt_records_fn,
-    )
+    desc = f"Building input records (num_proc={num_processes})"
+    total = len(selected_turns)
 
     if num_processes > 1:
+        if chunksize is None:
+            chunksize = max(1, total // (num_processes * 4))
+
+        indexed_records = []
+
+        if backend == "process":
+            # The functions are sent once to each worker when it starts, instead of being
+            # pickled again with every chunk of turns
+            pool = Pool(
+                num_processes,
+                initializer=_init_build_input_record_worker,
+                initargs=(
+                    format_intent,
+                    build_prompt_records_fn,
+                    format_prompt_records_fn,
+                    format_output_dict_fn,
+                ),
+                maxtasksperchild=maxtasksperchild,
+            )
+            func = _build_input_record_in_worker
+        else:
+            # The threads share the functions with the current process
+            pool = ThreadPool(num_processes)
+            func = partial(
+                _build_input_record_in_worker,
+                build_kwargs={
+                    "format_intent": format_intent,
+                    "build_prompt_records_fn": build_prompt_records_fn,
+                    "format_prompt_records_fn": format_prompt_records_fn,
+                    "format_output_dict_fn": format_output_dict_fn,
+                },
+            )
 
-        pool = Pool(num_processes)
-        # pool = ThreadPool(num_processes)
-        iterator = pool.imap(
-            func,
-            selected_turns,
-            chunksize=chunksize,
-        )
+        with pool:
+            iterator = pool.imap_unordered(
+                func, enumerate(selected_turns), chunksize=chunksize
+            )
+            iterator = _records_progress_bar(iterator, desc=desc, total=total)
+
+            if output_path is not None:
+                if preserve_order:
+                    records = _restore_order(iterator)
+                else:
+                    records = (rec for _, rec in iterator)
+
+                return _write_records_to_jsonl(records, output_path)
+
+            for indexed_rec in iterator:
+                indexed_records.append(indexed_rec)
+
+        if preserve_order:
+            indexed_records.sort(key=itemgetter(0))
+
+        input_records = [rec for _, rec in indexed_records]
     else:
-        iterator = map(
-            func,
-            selected_turns,
+        func = partial(
+            build_input_record_for_single_turn,
+            format_intent=format_intent,
+            build_prompt_records_fn=build_prompt_records_fn,
+            format_prompt_records_fn=format_prompt_records_fn,
+            format_output_dict_fn=format_output_dict_fn,
+        )
+        records = _records_progress_bar(
+            map(func, selected_turns), desc=desc, total=total
         )
 
-    input_records = []
+        if output_path is not None:
+            return _write_records_to_jsonl(records, output_path)
 
-    desc = f"Building input records (num_proc={num_processes})"
-    total = len(selected_turns)
-    for rec in tqdm(iterator, desc=desc, total=total):
-        input_records.append(rec)
+        for rec in records:
+            input_records.append(rec)
 
     return input_records
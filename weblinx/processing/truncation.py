@@ -1,17 +1,122 @@
 from copy import deepcopy
+from functools import lru_cache
 import json
 import logging
 import math
-from typing import TYPE_CHECKING
+from operator import attrgetter
+from typing import TYPE_CHECKING, NamedTuple
 
-from ..utils.recs import is_list_monotonically_increasing, get_list_from_records_by_key
+import numpy as np
+
+from ..utils.recs import is_list_monotonically_increasing
 from .dom import get_tree_repr_simple
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+else:
+    # numba logs its whole compilation pipeline at the DEBUG level
+    logging.getLogger("numba").setLevel(logging.WARNING)
+
 if TYPE_CHECKING:
     import lxml.html
     from transformers import PreTrainedTokenizer
 
 
+def get_num_tokens_in_batch(tokenizer: "PreTrainedTokenizer", texts: list) -> list:
+    """
+    Returns the number of tokens of each text in `texts` (without special tokens), using
+    a single call to the tokenizer. Only the lengths are requested from the tokenizer, so
+    the token strings are never created.
+
+    Parameters
+    ----------
+    tokenizer : PreTrainedTokenizer
+        The tokenizer to use to tokenize the texts.
+
+    texts : list of str
+        The texts to tokenize.
+
+    Returns
+    -------
+    list of int
+        The number of tokens in each text.
+    """
+    if len(texts) == 0:
+        return []
+
+    batch = tokenizer(
+        list(texts),
+        add_special_tokens=False,
+        return_attention_mask=False,
+        return_token_type_ids=False,
+        return_length=True,
+    )
+    return list(batch["length"])
+
+
+def get_num_tokens(tokenizer: "PreTrainedTokenizer", text: str) -> int:
+    """
+    Returns the number of tokens of `text` (without special tokens). This is equivalent to
+    `len(tokenizer.tokenize(text, add_special_tokens=False))`, but does not create the
+    token strings.
+
+    Parameters
+    ----------
+    tokenizer : PreTrainedTokenizer
+        The tokenizer to use to tokenize the text.
+
+    text : str
+        The text to tokenize.
+
+    Returns
+    -------
+    int
+        The number of tokens in the text.
+    """
+    return get_num_tokens_in_batch(tokenizer, [text])[0]
+
+
+@lru_cache(maxsize=256)
+def _get_num_tokens_cached(tokenizer: "PreTrainedTokenizer", text: str) -> int:
+    """
+    Number of tokens of a constant string (e.g. a separator or an ellipsis), cached per
+    tokenizer so that it is only tokenized once.
+    """
+    return get_num_tokens(tokenizer, text)
+
+
+def get_num_tokens_of_constant(tokenizer: "PreTrainedTokenizer", text: str) -> int:
+    """
+    Returns the number of tokens of `text` without special tokens. This is meant for short
+    strings that are reused many times with the same tokenizer, such as separators, so
+    the result is cached. If the tokenizer cannot be hashed, the text is tokenized every time.
+
+    Parameters
+    ----------
+    tokenizer : PreTrainedTokenizer
+        The tokenizer to use to tokenize the text.
+
+    text : str
+        The text to tokenize.
+
+    Returns
+    -------
+    int
+        The number of tokens in the text.
+    """
+    try:
+        return _get_num_tokens_cached(tokenizer, text)
+    except TypeError:
+        return get_num_tokens(tokenizer, text)
+
+
 def get_bracket_length(
     elem_open_bracket, elem_close_bracket, tokenizer: "PreTrainedTokenizer"
 ):
@@ -41,11 +146,87 @@ def get_bracket_length(
         elem_close_bracket = ""
 
     elem_brackets = elem_open_bracket + elem_close_bracket
-    bracket_length = len(tokenizer.tokenize(elem_brackets, add_special_tokens=False))
+    bracket_length = get_num_tokens_of_constant(tokenizer, elem_brackets)
 
     return bracket_length
 
 
+def _reduce_sorted_lengths(lengths, max_length):
+    """
+    Array version of the loop in `reduce_list_of_lengths`, written with plain loops so that
+    it can be compiled with numba. `lengths` must be a sorted int64 array whose sum is
+    greater than `max_length`, and `max_length` must be positive.
+    """
+    n = lengths.shape[0]
+    new_lengths = np.empty(n, dtype=np.int64)
+    cumsum = 0
+    prev_length = 0
+    i = 0
+
+    while i < n:
+        length = lengths[i]
+        cumsum += (length - prev_length) * (n - i)
+
+        if cumsum > max_length:
+            break
+
+        new_lengths[i] = length
+        prev_length = length
+        i += 1
+
+    # Same as math.ceil((cumsum - max_length) / (n - i)), but with integer arithmetic
+    diff_per_rec = -((max_length - cumsum) // (n - i))
+    new_lengths[i:] = lengths[i] - diff_per_rec
+
+    diff = max_length - new_lengths.sum()
+
+    if diff < 0:
+        raise ValueError("Difference must be greater than or equal to 0.")
+
+    new_lengths[n - diff :] += 1
+
+    return new_lengths
+
+
+if numba is not None:
+    # nogil lets the compiled loop run concurrently when records are built with threads
+    _reduce_list_of_lengths_nb = numba.njit(cache=True, nogil=True)(
+        _reduce_sorted_lengths
+    )
+else:
+    _reduce_list_of_lengths_nb = None
+
+# Below these numbers of lengths, the overhead of converting the lengths to an array is
+# larger than the time saved by numpy or by the compiled loop
+_MIN_NUM_LENGTHS_FOR_NUMPY = 64
+_MIN_NUM_LENGTHS_FOR_NUMBA = 128
+
+
+def _reduce_sorted_lengths_np(lengths, max_length):
+    """
+    Vectorized version of `_reduce_sorted_lengths` with numpy, with the same requirements.
+    """
+    n = lengths.shape[0]
+    # Cumulative sum of the lengths of the remaining records in terms of the incremental
+    # length difference, i.e. the total length if every record after i was cut to lengths[i]
+    cumsum = np.cumsum(np.diff(lengths, prepend=0) * np.arange(n, 0, -1))
+    i = int(np.searchsorted(cumsum, max_length, side="right"))
+
+    new_lengths = lengths.copy()
+    # Same as math.ceil((cumsum[i] - max_length) / (n - i)), but with integer arithmetic
+    diff_per_rec = -((max_length - int(cumsum[i])) // (n - i))
+    new_lengths[i:] = lengths[i] - diff_per_rec
+
+    diff = max_length - int(new_lengths.sum())
+
+    if diff < 0:
+        raise ValueError("Difference must be greater than or equal to 0.")
+
+    new_lengths[n - diff :] += 1
+
+    return new_lengths
+
+
 def reduce_list_of_lengths(lengths: list, max_length: int, assert_exactly_max=True):
     """
     Given a list of lengths, reduce the lengths to a maximum length. To learn more
@@ -79,11 +260,25 @@ def reduce_list_of_lengths(lengths: list, max_length: int, assert_exactly_max=Tr
         If assert_exactly_max is True and the total length of the reduced list of lengths
         is not exactly equal to max_length. Also, if the lengths are not monotonically
         increasing (i.e., the lengths are not sorted by length).
+
+    Note
+    ----
+    Long lists of lengths are reduced with vectorized numpy operations. If numba is
+    installed (`pip install numba`), the longest lists are instead reduced with a loop that
+    is compiled to native code the first time it is called.
     """
+    use_numpy = len(lengths) >= _MIN_NUM_LENGTHS_FOR_NUMPY
+
     # Assert lengths is monotonically increasing
-    assert is_list_monotonically_increasing(lengths), "Lengths must be sorted by length"
+    if use_numpy:
+        lengths_arr = np.asarray(lengths, dtype=np.int64)
+        is_sorted = bool(np.all(np.diff(lengths_arr) >= 0))
+        total_length = int(lengths_arr.sum())
+    else:
+        is_sorted = is_list_monotonically_increasing(lengths)
+        total_length = sum(lengths)
 
-    total_length = sum(lengths)
+    assert is_sorted, "Lengths must be sorted by length"
 
     if total_length <= max_length:
         return lengths
@@ -91,6 +286,25 @@ def reduce_list_of_lengths(lengths: list, max_length: int, assert_exactly_max=Tr
     if max_length <= 0:
         return [0] * len(lengths)
 
+    if use_numpy:
+        use_numba = (
+            _reduce_list_of_lengths_nb is not None
+            and len(lengths) >= _MIN_NUM_LENGTHS_FOR_NUMBA
+        )
+        if use_numba:
+            new_lengths = _reduce_list_of_lengths_nb(lengths_arr, max_length)
+        else:
+            new_lengths = _reduce_sorted_lengths_np(lengths_arr, max_length)
+
+        new_lengths = new_lengths.tolist()
+
+        if assert_exactly_max:
+            assert (
+                sum(new_lengths) == max_length
+            ), "Total length must be exactly max_length"
+
+        return new_lengths
+
     # We will iterate through the records and calculate the cumulative sum of the lengths.
     # If at iteration i, the cumulative sum is greater than the max_length, then we will stop, then:
     # 1. Set the length of the subsequent records to be equal to the length of record i
@@ -204,8 +418,7 @@ def truncate_text_at_center(
         raise ValueError("Either ellipsis or ellipsis_length must be specified")
 
     if ellipsis_length is None:
-        ellipsis_token = tokenizer.tokenize(ellipsis, add_special_tokens=False)
-        ellipsis_length = len(ellipsis_token)
+        ellipsis_length = get_num_tokens_of_constant(tokenizer, ellipsis)
 
     if tokens is None:
         tokens = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
@@ -243,8 +456,7 @@ def truncate_text_at_center(
                 tokens, length, num_tokens_to_remove
             )
             text = init_text[:start_offset] + ellipsis + init_text[end_offset:]
-            new_tokens = tokenizer(text, add_special_tokens=False)
-            is_smaller_or_equal = len(new_tokens["input_ids"]) <= max_tokens
+            is_smaller_or_equal = get_num_tokens(tokenizer, text) <= max_tokens
 
     results = {"text": text}
     if assert_max_tokens or allow_retry_without_ellipsis:
@@ -254,7 +466,9 @@ def truncate_text_at_center(
 
         results["tokens"] = tokens
 
-        if allow_retry_without_ellipsis and not is_smaller_or_equal:
+        # The text without the ellipsis is only used for the assertion below, so it is
+        # not tokenized when nothing is asserted
+        if allow_retry_without_ellipsis and assert_max_tokens and not is_smaller_or_equal:
             text = init_text[:start_offset] + init_text[end_offset:]
             tokens = tokenizer(text, add_special_tokens=False)
             is_smaller_or_equal = len(tokens["input_ids"]) <= max_tokens
@@ -266,51 +480,158 @@ def truncate_text_at_center(
     return results
 
 
+def _get_truncation_offsets_in_batch(flat_offsets, bases, lengths, num_tokens_to_remove):
+    """
+    Vectorized version of `get_truncation_offsets`. `flat_offsets` is the concatenation of
+    the offset mappings of several texts (as an array of shape (total, 2)), `bases` is the
+    position of the first token of each text in `flat_offsets`, and `lengths` and
+    `num_tokens_to_remove` are arrays with one value per text.
+    """
+    left = lengths // 2 - num_tokens_to_remove // 2
+    right = left + num_tokens_to_remove
+
+    start_offsets = flat_offsets[bases + left, 0]
+    end_offsets = flat_offsets[bases + right - 1, 1]
+
+    return start_offsets, end_offsets
+
+
+def _batch_truncate_text_at_center(
+    texts: list,
+    max_tokens_list: list,
+    tokenizer: "PreTrainedTokenizer",
+    ellipsis: str = "...",
+    ellipsis_length: int = None,
+    allow_iterative_reduction=False,
+):
+    """
+    Batched version of `truncate_text_at_center`, which truncates `texts[i]` to at most
+    `max_tokens_list[i]` tokens. All the texts are tokenized in a single call, the offsets
+    are computed with numpy on the concatenated offset mappings, and the truncated texts
+    are tokenized again in a single call to get their final length. Returns a list with
+    one dictionary per text with the keys "text" and "length".
+
+    With `allow_iterative_reduction`, the texts that are still too long after being
+    truncated have one more token removed and are tokenized again (together, in a single
+    call), until all of them fit.
+    """
+    if len(texts) == 0:
+        return []
+
+    if ellipsis_length is None:
+        ellipsis_length = get_num_tokens_of_constant(tokenizer, ellipsis)
+
+    batch = tokenizer(
+        list(texts),
+        add_special_tokens=False,
+        return_attention_mask=False,
+        return_offsets_mapping=True,
+    )
+    offset_mappings = batch["offset_mapping"]
+    lengths = np.fromiter(
+        (len(offsets) for offsets in offset_mappings), dtype=np.int64, count=len(texts)
+    )
+    max_tokens_arr = np.asarray(max_tokens_list, dtype=np.int64)
+    num_tokens_to_remove = lengths - (max_tokens_arr - ellipsis_length)
+    is_truncated = (lengths > max_tokens_arr) & (max_tokens_arr > ellipsis_length)
+
+    results = []
+    for i, text in enumerate(texts):
+        if is_truncated[i]:
+            results.append({"text": None, "length": None})
+        elif lengths[i] <= max_tokens_arr[i]:
+            results.append({"text": text, "length": int(lengths[i])})
+        elif max_tokens_arr[i] < ellipsis_length:
+            # If we don't have enough tokens to allocate, then we should just remove the text
+            results.append({"text": None, "length": 0})
+        else:
+            results.append({"text": ellipsis, "length": ellipsis_length})
+
+    idx = np.flatnonzero(is_truncated)
+    if len(idx) == 0:
+        return results
+
+    flat_offsets = np.array(
+        [o for offsets in offset_mappings for o in offsets], dtype=np.int64
+    ).reshape(-1, 2)
+    bases = np.cumsum(lengths) - lengths
+
+    # Like `truncate_text_at_center`, the iterative reduction always removes at least one
+    # more token, then keeps removing one token from the texts that are still too long.
+    # Once all the tokens are removed, only the ellipsis is left, so we stop there.
+    if allow_iterative_reduction:
+        num_tokens_to_remove[idx] += 1
+
+    while len(idx) > 0:
+        start_offsets, end_offsets = _get_truncation_offsets_in_batch(
+            flat_offsets, bases[idx], lengths[idx], num_tokens_to_remove[idx]
+        )
+        for i, start, end in zip(idx, start_offsets, end_offsets):
+            results[i]["text"] = texts[i][:start] + ellipsis + texts[i][end:]
+
+        # Tokenize the truncated texts again, in a single call, to get their final lengths
+        final_lengths = get_num_tokens_in_batch(
+            tokenizer, [results[i]["text"] for i in idx]
+        )
+        for i, length in zip(idx, final_lengths):
+            results[i]["length"] = length
+
+        if not allow_iterative_reduction:
+            break
+
+        final_lengths = np.asarray(final_lengths, dtype=np.int64)
+        idx = idx[
+            (final_lengths > max_tokens_arr[idx])
+            & (num_tokens_to_remove[idx] < lengths[idx])
+        ]
+        num_tokens_to_remove[idx] += 1
+
+    return results
+
+
+class _DomTreeRecord(NamedTuple):
+    """
+    The text of a node, or the value of one of its attributes (in which case `key` is the
+    name of the attribute), with its number of tokens.
+    """
+
+    node: "lxml.html.HtmlElement"
+    type: str
+    text: str
+    length: int
+    key: str = None
+
+
 def build_records_of_tokens_for_dom_tree(
     dom_tree: "lxml.html.HtmlElement",
     tokenizer: "PreTrainedTokenizer",
     sorted_by_length: bool = True,
 ):
-    records = []
+    entries = []
     for node in dom_tree.iter():
         if node.text is not None:
             text = node.text.strip()
         else:
             text = ""
 
-        # text_tokens = tokenizer.tokenize(text, add_special_tokens=False)
-        records.append(
-            {
-                "node": node,
-                "type": "text",
-                "text": text,
-            }
-        )
+        # Empty texts have no tokens and never need to be truncated, so we skip them
+        if text != "":
+            entries.append((node, "text", text, None))
 
         for k, v in node.attrib.items():
-            # value_tokens = tokenizer.tokenize(v, add_special_tokens=False)
-            records.append(
-                {
-                    "node": node,
-                    "key": k,
-                    "type": "attrib",
-                    "text": v,
-                }
-            )
+            if v is None or v == "":
+                continue
 
-    tokens = tokenizer(
-        get_list_from_records_by_key(records, "text"),
-        add_special_tokens=False,
-        return_attention_mask=False,
-        return_length=True,
-    )
-    lengths = tokens["length"]
+            entries.append((node, "attrib", v, k))
 
-    for i, r in enumerate(records):
-        r["length"] = lengths[i]
+    lengths = get_num_tokens_in_batch(tokenizer, [entry[2] for entry in entries])
+    records = [
+        _DomTreeRecord(node=node, type=type_, text=text, length=length, key=key)
+        for (node, type_, text, key), length in zip(entries, lengths)
+    ]
 
     if sorted_by_length:
-        records = sorted(records, key=lambda r: r["length"], reverse=False)
+        records.sort(key=attrgetter("length"))
 
     return records
 
@@ -323,6 +644,7 @@ def truncate_dom_tree(
     remove_when_none=True,
     copy=True,
     allow_iterative_reduction=False,
+    return_num_tokens_removed=False,
 ):
     """
     This function takes a dom tree and truncate it based on the number of tokens to remove.
@@ -357,10 +679,16 @@ def truncate_dom_tree(
         the updated text is retokenized to the same number of tokens, then we will continue
         to remove tokens until we reach the max_tokens limit.
 
+    return_num_tokens_removed : bool, optional
+        If True, then we will also return the number of tokens removed from the texts and
+        attributes of the tree. This can be less than `num_tokens_to_remove` if there are
+        not enough tokens to remove. Defaults to False.
+
     Returns
     -------
-    lxml.html.HtmlElement
-        The truncated dom tree.
+    lxml.html.HtmlElement or tuple
+        The truncated dom tree, or a tuple of the truncated dom tree and the number of tokens
+        removed if `return_num_tokens_removed` is True.
     """
     # Unlike the naive approach, we will remove the tokens starting from the node
     # with the most tokens, then work our way down until we have removed the
@@ -368,7 +696,7 @@ def truncate_dom_tree(
     if copy:
         dom_tree = deepcopy(dom_tree)
 
-    ellipsis_length = len(tokenizer.tokenize(ellipsis, add_special_tokens=False))
+    ellipsis_length = get_num_tokens_of_constant(tokenizer, ellipsis)
     # Note: We only count the token lengths of the values, not the entire formatted string
     # The full string may have additional tokens (key, separator, etc.)
     # Consequently, max_total_length is different from max_tokens
@@ -376,54 +704,73 @@ def truncate_dom_tree(
         dom_tree, tokenizer, sorted_by_length=True
     )
 
-    lengths_orig = get_list_from_records_by_key(records, "length")
+    # If there are no texts or attributes, there is nothing to truncate
+    if len(records) == 0:
+        return (dom_tree, 0) if return_num_tokens_removed else dom_tree
+
+    lengths_orig = [r.length for r in records]
     max_total_length = sum(lengths_orig) - num_tokens_to_remove
     lengths_reduced = reduce_list_of_lengths(lengths_orig, max_length=max_total_length)
 
+    # Truncate all the texts that need it at once, rather than one at a time with
+    # `truncate_text_at_center`
+    trunc_indices = [
+        i for i, r in enumerate(records) if 0 < lengths_reduced[i] < r.length
+    ]
+    truncs = _batch_truncate_text_at_center(
+        [records[i].text for i in trunc_indices],
+        [lengths_reduced[i] for i in trunc_indices],
+        tokenizer=tokenizer,
+        ellipsis=ellipsis,
+        ellipsis_length=ellipsis_length,
+        allow_iterative_reduction=allow_iterative_reduction,
+    )
+    trunc_by_index = dict(zip(trunc_indices, truncs))
+
+    # The attributes to set and to remove are grouped by node, so that each node's
+    # attributes are updated at once after the loop
+    attrib_mods_by_node = {}
+
     for i, r in enumerate(records):
         red_length = lengths_reduced[i]
         # If the length is the same, then we don't need to do anything
-        if red_length >= r["length"]:
+        if red_length >= r.length:
             continue
 
-        # If the reduced length is 0 (but original is not), then we should remove the node
-        if red_length == 0:
-            if r["type"] == "text":
-                r["node"].text = None
-
-            elif r["type"] != "attrib":
-                raise ValueError(
-                    f"Unknown type: {r['type']}. Must be 'text' or 'attrib'"
-                )
+        if r.type not in ("text", "attrib"):
+            raise ValueError(f"Unknown type: {r.type}. Must be 'text' or 'attrib'")
 
-            elif remove_when_none and r["text"] is None:
-                r["node"].attrib.pop(r["key"])
-
-            else:
-                r["node"].attrib[r["key"]] = None
+        # If the reduced length is 0 (but original is not), then we should remove the node,
+        # otherwise we use the truncated text
+        if red_length == 0:
+            new_text = None
+            remove_attrib = remove_when_none and r.text is None
+        else:
+            new_text = trunc_by_index[i]["text"]
+            remove_attrib = remove_when_none and new_text is None
 
+        if r.type == "text":
+            r.node.text = new_text
             continue
 
-        # Otherwise, we need to truncate the text
-        trunc = truncate_text_at_center(
-            r["text"],
-            tokenizer=tokenizer,
-            max_tokens=red_length,
-            ellipsis_length=ellipsis_length,
-            allow_iterative_reduction=allow_iterative_reduction,
-        )
+        node_id = id(r.node)
+        if node_id not in attrib_mods_by_node:
+            attrib_mods_by_node[node_id] = (r.node, {}, [])
 
-        if r["type"] == "text":
-            r["node"].text = trunc["text"]
+        if remove_attrib:
+            attrib_mods_by_node[node_id][2].append(r.key)
+        else:
+            attrib_mods_by_node[node_id][1][r.key] = new_text
 
-        elif r["type"] != "attrib":
-            raise ValueError(f"Unknown type: {r['type']}. Must be 'text' or 'attrib'")
+    for node, attribs_to_set, attribs_to_remove in attrib_mods_by_node.values():
+        if attribs_to_set:
+            node.attrib.update(attribs_to_set)
 
-        elif remove_when_none and trunc["text"] is None:
-            r["node"].attrib.pop(r["key"])
+        for key in attribs_to_remove:
+            node.attrib.pop(key)
 
-        else:
-            r["node"].attrib[r["key"]] = trunc["text"]
+    if return_num_tokens_removed:
+        return dom_tree, sum(lengths_orig) - sum(lengths_reduced)
 
     return dom_tree
 
@@ -447,35 +794,62 @@ def multi_attempt_truncate_dom_tree(
     we need to try multiple times to truncate the dom_tree to the specified number.
     If after max_attempts, we are still unable to truncate the dom_tree to the
     specified number of tokens, then we will truncate the resulting text directly.
+
+    After each attempt, the number of tokens is estimated from the number of tokens removed
+    by `truncate_dom_tree`. The tree is only serialized and tokenized again if the estimate
+    fits within `max_tokens` (to confirm it), since otherwise another attempt is needed anyway.
+
+    If `copy_tree` is True, the dom_tree is copied once before the first truncation (rather
+    than at every attempt), and the attempts then modify that copy in place.
+
+    The last serialized representation is kept until an attempt actually modifies the tree
+    (i.e. removes tokens), so an unchanged tree is never serialized twice.
     """
+    num_tokens = None
+    tree_repr = None
+    is_copied = not copy_tree
+
     for num_attempts in range(max_attempts):
-        tree_repr = get_tree_repr_simple(dom_tree)
-        tokens = tokenizer.tokenize(tree_repr, add_special_tokens=False)
-        num_tokens = len(tokens)
+        if num_tokens is None or num_tokens <= max_tokens:
+            if tree_repr is None:
+                tree_repr = get_tree_repr_simple(dom_tree, copy=False)
+            num_tokens = get_num_tokens(tokenizer, tree_repr)
+
+            if num_tokens <= max_tokens:
+                results = {"dom_tree": dom_tree, "tree_repr": tree_repr}
+                if compute_final_num_tokens:
+                    results["num_tokens"] = num_tokens
 
-        if num_tokens <= max_tokens:
-            results = {"dom_tree": dom_tree, "tree_repr": tree_repr}
-            if compute_final_num_tokens:
-                results["num_tokens"] = num_tokens
+                return results
 
-            return results
+        if not is_copied:
+            dom_tree = deepcopy(dom_tree)
+            is_copied = True
 
-        dom_tree = truncate_dom_tree(
+        dom_tree, num_tokens_removed = truncate_dom_tree(
             dom_tree=dom_tree,
             tokenizer=tokenizer,
             num_tokens_to_remove=num_tokens - max_tokens,
             ellipsis=ellipsis,
             remove_when_none=num_attempts > 1,
-            copy=copy_tree,
+            copy=False,
             allow_iterative_reduction=allow_iterative_reduction,
+            return_num_tokens_removed=True,
         )
+        num_tokens -= num_tokens_removed
+
+        if num_tokens_removed > 0:
+            tree_repr = None
+
     if warn_after_attempts:
         logging.warning(
             "Reached max # of attempts when trying to run `truncate_dom_tree`. "
             "We will be truncating the text directly."
         )
 
-    tree_repr = get_tree_repr_simple(dom_tree)
+    if tree_repr is None:
+        tree_repr = get_tree_repr_simple(dom_tree, copy=False)
+
     trunc = truncate_text_at_center(
         tree_repr,
         tokenizer=tokenizer,
@@ -486,7 +860,7 @@ def multi_attempt_truncate_dom_tree(
     results = {"dom_tree": dom_tree, "tree_repr": tree_repr}
 
     if compute_final_num_tokens:
-        num_tokens = len(tokenizer.tokenize(tree_repr, add_special_tokens=False))
+        num_tokens = get_num_tokens(tokenizer, tree_repr)
         results["num_tokens"] = num_tokens
 
     return results
@@ -509,7 +883,8 @@ def convert_elem_dict_to_str(elem_dict: dict, remove_empty=False):
     str
         The string representation of the element dictionary.
     """
-    elem_dict = deepcopy(elem_dict)
+    # Only the top-level keys are removed below, so a shallow copy is enough
+    elem_dict = dict(elem_dict)
     element_str = ""
 
     for elem in ["tag", "xpath", "text", "bbox", "attributes", "children"]:
@@ -534,7 +909,8 @@ def convert_elem_dict_to_str_dmr(elem_dict: dict):
     """
     Convert an element dictionary to a string.
     """
-    elem_dict = deepcopy(elem_dict)
+    # Only the top-level keys are removed below, so a shallow copy is enough
+    elem_dict = dict(elem_dict)
 
     element_str = f"[[tag]] {elem_dict.pop('tag')}\n"
     element_str += f"[[xpath]] {elem_dict.pop('xpath')}\n"
@@ -550,6 +926,35 @@ def convert_elem_dict_to_str_dmr(elem_dict: dict):
 
     return element_str
 
+def _serialize_elem_value(value, json_backend="json"):
+    """
+    Serializes a list or dict value of an element dictionary to a string. With the 'json'
+    backend, lists of numbers (e.g. bounding boxes) are formatted directly, giving the same
+    string as `json.dumps` without going through the encoder.
+    """
+    if json_backend == "orjson":
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    if isinstance(value, list) and all(
+        type(x) is int or (type(x) is float and math.isfinite(x)) for x in value
+    ):
+        return "[" + ", ".join(map(repr, value)) + "]"
+
+    return json.dumps(value)
+
+
+class _CandidateValueRecord(NamedTuple):
+    """
+    The value of a key in the `elem_dict` of the `index`-th candidate, serialized as a
+    string, with its number of tokens.
+    """
+
+    index: int
+    key: str
+    value: str
+    length: int
+
+
 def truncate_cands_turn(
     cands_turn: list,
     tokenizer: "PreTrainedTokenizer",
@@ -558,6 +963,8 @@ def truncate_cands_turn(
     copy: bool = True,
     remove_empty=True,
     allow_iterative_reduction=False,
+    json_backend="json",
+    num_tokens_cache: dict = None,
 ):
     """
     This truncates the candidates turn to the specified number of tokens. This is useful
@@ -591,18 +998,44 @@ def truncate_cands_turn(
         the updated text is retokenized to the same number of tokens, then we will continue
         to remove tokens until we reach the max_tokens limit.
 
+    json_backend : str, optional
+        The backend used to serialize list and dict values before truncating them, either
+        'json' or 'orjson'. 'orjson' is faster, but it does not add spaces after the
+        separators, so the candidates will be different from the ones obtained with 'json'.
+        Defaults to 'json'.
+
+    num_tokens_cache : dict, optional
+        A dictionary mapping values (after serialization) to their number of tokens. If
+        given, only the values that are not in it are tokenized, and it is updated with
+        these values and with the truncated values. Defaults to None.
+
     Returns
     -------
     list
         The truncated candidates turn.
     """
+    if json_backend not in ("json", "orjson"):
+        raise ValueError(
+            f"Invalid json_backend '{json_backend}'. Must be either 'json' or 'orjson'"
+        )
+
+    if json_backend == "orjson" and orjson is None:
+        raise ImportError(
+            "orjson is not installed. Please change your json backend or install "
+            "it with `pip install orjson`"
+        )
+
     if num_tokens_to_remove <= 0:
         return cands_turn
 
     protected_elem_keys = set(protected_elem_keys)
     if copy:
-        cands_turn = deepcopy(cands_turn)
-    records = []
+        # only the elem_dict values and the doc are replaced below, so there is no
+        # need to deepcopy the whole candidates turn
+        cands_turn = [
+            {**cand, "elem_dict": dict(cand["elem_dict"])} for cand in cands_turn
+        ]
+    entries = []
 
     # Otherwise, we need to truncate the candidates turn
     for t, cand in enumerate(cands_turn):
@@ -617,45 +1050,54 @@ def truncate_cands_turn(
                 value_str = str(value)
 
             elif isinstance(value, (list, dict)):
-                value_str = json.dumps(value)
+                value_str = _serialize_elem_value(value, json_backend=json_backend)
 
             else:
                 value_str = value
 
-            tokens = tokenizer.tokenize(value_str, add_special_tokens=False)
-
-            records.append(
-                {
-                    "index": t,
-                    "key": key,
-                    "value": value_str,
-                    "cand": cand,
-                    "tokens": tokens,
-                    "length": len(tokens),
-                }
-            )
+            entries.append((t, key, value_str))
+
+    # Count the tokens of all the values at once, rather than one value at a time
+    values = [entry[2] for entry in entries]
+    if num_tokens_cache is None:
+        lengths = get_num_tokens_in_batch(tokenizer, values)
+    else:
+        missing = [v for v in dict.fromkeys(values) if v not in num_tokens_cache]
+        num_tokens_cache.update(
+            zip(missing, get_num_tokens_in_batch(tokenizer, missing))
+        )
+        lengths = [num_tokens_cache[v] for v in values]
+    records = [
+        _CandidateValueRecord(index=t, key=key, value=value_str, length=length)
+        for (t, key, value_str), length in zip(entries, lengths)
+    ]
+
     # Note: We only count the token lengths of the values, not the entire formatted string
     # The full string may have additional tokens (key, separator, etc.)
     # Consequently, max_total_length is different from max_tokens
-    records = sorted(records, key=lambda r: r["length"])
-    lengths_orig = get_list_from_records_by_key(records, "length")
+    records.sort(key=attrgetter("length"))
+    lengths_orig = [r.length for r in records]
     max_total_length = sum(lengths_orig) - num_tokens_to_remove
     lengths_reduced = reduce_list_of_lengths(lengths_orig, max_length=max_total_length)
 
-    for i, rec in enumerate(records):
-        red_length = lengths_reduced[i]
-        # If the length is the same, then we don't need to do anything
-        if red_length >= rec["length"]:
-            continue
-        # Otherwise, we need to truncate the text
-        trunc = truncate_text_at_center(
-            rec["value"],
-            tokenizer=tokenizer,
-            max_tokens=red_length,
-            allow_iterative_reduction=allow_iterative_reduction,
-        )
+    # Truncate all the values that need it at once, rather than one at a time with
+    # `truncate_text_at_center`. Values whose length is unchanged are left as is.
+    trunc_indices = [
+        i for i, rec in enumerate(records) if lengths_reduced[i] < rec.length
+    ]
+    truncs = _batch_truncate_text_at_center(
+        [records[i].value for i in trunc_indices],
+        [lengths_reduced[i] for i in trunc_indices],
+        tokenizer=tokenizer,
+        allow_iterative_reduction=allow_iterative_reduction,
+    )
+
+    for i, trunc in zip(trunc_indices, truncs):
+        rec = records[i]
+        cands_turn[rec.index]["elem_dict"][rec.key] = trunc["text"]
 
-        cands_turn[rec["index"]]["elem_dict"][rec["key"]] = trunc["text"]
+        if num_tokens_cache is not None and trunc["text"] is not None:
+            num_tokens_cache[trunc["text"]] = trunc["length"]
 
     # Finally, we update cands_turn[i]["doc"] to reflect the changes
     for cand in cands_turn:
@@ -675,18 +1117,24 @@ def multi_attempt_truncate_cands_turn(
     warn_after_attempts: bool = True,
     protected_elem_keys=("tag", "bbox"),
     allow_iterative_reduction=False,
+    json_backend="json",
 ):
     """
     This is a more robust version of `truncate_cands_turn`. It will attempt to truncate
     the candidates turn to the specified number of tokens. If after max_attempts, we are
     still unable to truncate the candidates turn to the specified number of tokens, then
     we will truncate the resulting text directly, as a last resort.
+
+    The number of tokens of the values of the candidates is shared between the attempts,
+    so that only the values that are new (i.e. were not truncated yet) are tokenized.
     """
+    num_tokens_cache = {}
+
     for _ in range(max_attempts + 1):
         cands_turn_str = format_candidates_fn(cands_turn, max_char_len=None)
-        cands_turn_tokens = tokenizer.tokenize(cands_turn_str, add_special_tokens=False)
+        num_cands_turn_tokens = get_num_tokens(tokenizer, cands_turn_str)
 
-        num_tokens_to_remove = len(cands_turn_tokens) - max_tokens
+        num_tokens_to_remove = num_cands_turn_tokens - max_tokens
 
         if num_tokens_to_remove <= 0:
             return cands_turn
@@ -697,18 +1145,19 @@ def multi_attempt_truncate_cands_turn(
             num_tokens_to_remove=num_tokens_to_remove,
             protected_elem_keys=protected_elem_keys,
             allow_iterative_reduction=allow_iterative_reduction,
+            json_backend=json_backend,
+            num_tokens_cache=num_tokens_cache,
         )
 
     if warn_after_attempts:
         logging.warning(f"Reached max # of attempts to truncate cands_turn ")
 
     # We will try to truncate the text directly
-    tokens_no_format = tokenizer.tokenize(
-        " ".join([cand["doc"] for cand in cands_turn]),
-        add_special_tokens=False,
+    num_tokens_no_format = get_num_tokens(
+        tokenizer, " ".join([cand["doc"] for cand in cands_turn])
     )
     sep_len = math.ceil(
-        (len(cands_turn_tokens) - len(tokens_no_format)) / len(cands_turn)
+        (num_cands_turn_tokens - num_tokens_no_format) / len(cands_turn)
     )
     num_tokens_remaining = max_tokens
     num_cands_remaining = len(cands_turn)
@@ -721,8 +1170,7 @@ def multi_attempt_truncate_cands_turn(
             allow_iterative_reduction=allow_iterative_reduction,
         )
         cand["doc"] = trunc["text"]
-        tokens = tokenizer.tokenize(trunc["text"], add_special_tokens=False)
-        num_tokens_remaining -= len(tokens) + sep_len
+        num_tokens_remaining -= get_num_tokens(tokenizer, trunc["text"]) + sep_len
         num_cands_remaining -= 1
 
     return cands_turn
@@ -2,12 +2,34 @@
 This contains a collection of utility functions, and include submodules for different categories of utility functions.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 import hashlib
 import json
+import mmap
+import os
+import random
+import re
+from importlib import import_module
 from importlib.util import find_spec
 
-from . import url, envs, html, recs
+# The submodules are only imported when they are first accessed (e.g. `utils.html`),
+# through the module-level __getattr__ below, rather than when this module is imported
+_LAZY_SUBMODULES = ("url", "envs", "html", "recs")
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        module = import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_SUBMODULES))
 
 
 def shorten_text(s, max_length=100):
@@ -18,12 +40,23 @@ def shorten_text(s, max_length=100):
     return s
 
 
+# Matches the "<num_1>-<num_2>" at the end of the file name, before the extension
+_NUMS_IN_PATH_PATTERN = re.compile(
+    r"(?:.*/)?(?:[^./]*-)?(\d+)-(\d+)(?:\.[^./]+)?", re.ASCII
+)
+
+
 def get_nums_from_path(path):
     """
     Finds the first and second number in a path. The path should follow the
     following pattern: <prefix>-<num_1>-<num_2>.<ext>, e.g. `screenshot-15-1.png`
     or `page-15-1.html`, which would return `15` and `1` for both cases.
     """
+    match = _NUMS_IN_PATH_PATTERN.fullmatch(str(path))
+    if match is not None:
+        return int(match.group(1)), int(match.group(2))
+
+    # Fallback for names the pattern does not cover, which also raises the same errors
     path = Path(path)
     name = path.with_suffix("").name
 
@@ -51,22 +84,118 @@ def rank_paths(path, max_num_2=1, epsilon=1):
     return float(num_1) + (float(num_2) / denom)
 
 
+def rank_paths_many(paths, max_num_2=1, epsilon=1):
+    """
+    Vectorized version of `rank_paths`, which returns the ranks of all the `paths` as a
+    numpy array of floats. The numbers are parsed once per path, then the ranks are
+    computed with array operations, so that the paths can be sorted with
+    `np.argsort(ranks, kind="stable")`, which gives the same order as
+    `sorted(paths, key=rank_paths)`. This requires numpy to be installed.
+    """
+    import numpy as np
+
+    nums = np.array([get_nums_from_path(path) for path in paths], dtype=np.int64)
+    nums = nums.reshape(-1, 2)
+    denom = float(max_num_2) + epsilon
+
+    return nums[:, 0].astype(np.float64) + nums[:, 1] / denom
+
+
+_HASH_CHUNK_SIZE = 1 << 20
+_HASH_OVERLAP_CHUNK_SIZE = 4 << 20
+_HASH_OVERLAP_MIN_SIZE = 64 << 20
+
+
+def _resolve_hasher_constructor(name):
+    """
+    Returns the constructor of the `name` hasher. hashlib uses OpenSSL when it is available,
+    which picks the fastest implementation for the CPU at runtime (e.g. with the SHA
+    extensions). The hashes are not used for security, so `usedforsecurity=False` is
+    passed when supported (python 3.9+), which keeps md5 available on FIPS builds.
+    """
+    constructor = getattr(hashlib, name)
+    try:
+        constructor(usedforsecurity=False)
+    except TypeError:
+        return constructor
+
+    return partial(constructor, usedforsecurity=False)
+
+
+# Resolved once, instead of at every call of the hash_* functions
+_HASHER_CONSTRUCTORS = {
+    "md5": _resolve_hasher_constructor("md5"),
+    "sha256": _resolve_hasher_constructor("sha256"),
+}
+
+
+# Hashers from optional packages, as (package, constructor name). They are much faster
+# on short inputs, which makes them better suited for fingerprinting (e.g. cache keys)
+_OPTIONAL_HASHERS = {
+    "xxh3": ("xxhash", "xxh3_128"),
+    "blake3": ("blake3", "blake3"),
+}
+
+
+def _new_hasher(method, func_name):
+    """
+    Returns a new hasher for the given `method`, or raises a ValueError mentioning the
+    `func_name` that received the invalid method. The constructors of the optional
+    hashers are resolved the first time they are used.
+    """
+    if method not in _HASHER_CONSTRUCTORS and method in _OPTIONAL_HASHERS:
+        package, constructor_name = _OPTIONAL_HASHERS[method]
+        module = _import_optional_module(package)
+        if module is None:
+            raise ImportError(
+                f"The '{method}' method requires the `{package}` package. "
+                f"Please install it with `pip install {package}`."
+            )
+        _HASHER_CONSTRUCTORS[method] = getattr(module, constructor_name)
+
+    try:
+        return _HASHER_CONSTRUCTORS[method]()
+    except KeyError:
+        raise ValueError(
+            f"{func_name}'s 'method' arg must be either md5, sha256, xxh3 or blake3"
+        ) from None
+
+
+def _hash_file_overlapped(f, hasher, chunk_size=_HASH_OVERLAP_CHUNK_SIZE):
+    """
+    Hashes an opened binary file by reading the next chunk in a background thread while
+    the current chunk is hashed. Reading into a buffer and hashlib's update both release
+    the GIL, so the disk reads overlap with the hash computation instead of alternating
+    with it. The two buffers are reused, so no bytes object is created per chunk.
+    """
+    buffers = [bytearray(chunk_size), bytearray(chunk_size)]
+    i = 0
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(f.readinto, buffers[i])
+        while True:
+            num_bytes = future.result()
+            if not num_bytes:
+                break
+
+            future = executor.submit(f.readinto, buffers[1 - i])
+            with memoryview(buffers[i]) as view:
+                hasher.update(view[:num_bytes])
+            i = 1 - i
+
+    return hasher
+
+
 def hash_file(path, method="md5", error_on_missing=True):
     """
     Given a path to a file, this function will return the hash in hex of the file.
-    It can use either the md5 or sha256 method.
+    It can use either the md5 or sha256 method, or the xxh3 or blake3 method if the
+    xxhash or blake3 package is installed.
 
     If error_on_missing is True, then this function will raise a FileNotFoundError
     if the file does not exist. Otherwise, it will return None.
     """
-    if method == "md5":
-        hasher = hashlib.md5()
-
-    elif method == "sha256":
-        hasher = hashlib.sha256()
-
-    else:
-        raise ValueError("hash_file's 'method' arg must be either md5 or sha256")
+    hasher = _new_hasher(method, "hash_file")
 
     path = Path(path)
     if not path.exists():
@@ -75,56 +204,120 @@ def hash_file(path, method="md5", error_on_missing=True):
         else:
             return None
 
-    with open(path, "rb") as f:
-        hasher.update(f.read())
+    # The file is hashed without reading it entirely into memory: very large files are
+    # read and hashed concurrently, otherwise with file_digest on python 3.11+, by mapping
+    # large files in memory, or by chunks
+    with open(path, "rb", buffering=0) as f:
+        if path.stat().st_size > _HASH_OVERLAP_MIN_SIZE:
+            return _hash_file_overlapped(f, hasher).hexdigest()
+
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, lambda: hasher).hexdigest()
+
+        if path.stat().st_size >= _HASH_CHUNK_SIZE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+        else:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+                hasher.update(chunk)
 
     return hasher.hexdigest()
 
 
-def hash_str(s, method="md5"):
+def hash_files(paths, method="md5", error_on_missing=True, num_workers=8):
     """
-    Given a string, this function will return the hash in hex of the string.
-    It can use either the md5 or sha256 method.
+    Given a list of paths to files, this function will return a dictionary mapping each
+    path to the hash in hex of the file, computed with `hash_file`. The files are hashed
+    in `num_workers` threads, since hashlib releases the GIL while hashing large inputs,
+    so independent files are hashed in parallel.
+
+    If error_on_missing is True, then this function will raise a FileNotFoundError
+    if a file does not exist. Otherwise, its hash will be None.
     """
-    if method == "md5":
-        hasher = hashlib.md5()
+    paths = list(paths)
+    func = partial(hash_file, method=method, error_on_missing=error_on_missing)
 
-    elif method == "sha256":
-        hasher = hashlib.sha256()
+    if num_workers <= 1 or len(paths) <= 1:
+        return {path: func(path) for path in paths}
 
-    else:
-        raise ValueError("hash_str's 'method' arg must be either md5 or sha256")
+    with ThreadPoolExecutor(max_workers=min(num_workers, len(paths))) as executor:
+        return dict(zip(paths, executor.map(func, paths)))
+
+
+def _scan_files(root, recursive=False):
+    """
+    Yields the paths of the files in `root` (and its subdirectories if recursive is
+    True), using os.scandir which gets the file types without extra stat calls.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry.path
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path, recursive=True)
+
+
+def hash_tree(root, method="md5", recursive=False, num_workers=None):
+    """
+    Given a path to a directory, this function will return a dictionary mapping the path
+    of each file in the directory (and its subdirectories if recursive is True) to the
+    hash in hex of the file. The files are hashed in parallel with `hash_files`, with
+    `num_workers` threads (by default, the number of CPUs up to 32).
+    """
+    if num_workers is None:
+        num_workers = min(32, os.cpu_count() or 1)
+
+    paths = sorted(_scan_files(root, recursive=recursive))
+    return hash_files(paths, method=method, num_workers=num_workers)
+
+
+def hash_str(s, method="md5"):
+    """
+    Given a string, this function will return the hash in hex of the string.
+    It can use either the md5 or sha256 method, or the xxh3 or blake3 method if the
+    xxhash or blake3 package is installed. xxh3 is not a cryptographic hash, but is
+    much faster on short strings, so it can be used for fingerprinting (e.g. to
+    deduplicate records or as cache keys).
+    """
+    hasher = _new_hasher(method, "hash_str")
 
     hasher.update(s.encode("utf-8"))
 
     return hasher.hexdigest()
 
 
+# The optional json backends are resolved once at import, rather than at every call
+# of `hash_json`, `auto_read_json` and `auto_save_json`
+_orjson = import_module("orjson") if find_spec("orjson") else None
+_ujson = import_module("ujson") if find_spec("ujson") else None
+
+
 def hash_json(data, method="md5"):
     """
     Given a json object, this function will return the hash in hex of the json.
-    It can use either the md5 or sha256 method.
+    It can use either the md5 or sha256 method, or the xxh3 or blake3 method if the
+    xxhash or blake3 package is installed.
     """
-    if method == "md5":
-        hasher = hashlib.md5()
-
-    elif method == "sha256":
-        hasher = hashlib.sha256()
-
-    else:
-        raise ValueError("hash_json's 'method' arg must be either md5 or sha256")
+    hasher = _new_hasher(method, "hash_json")
 
+    # The serialization must stay the same across versions and environments, since the
+    # hashes are compared against the ones saved by previous runs (e.g. hashes.json)
     hasher.update(json.dumps(data, sort_keys=True).encode("utf-8"))
 
     return hasher.hexdigest()
 
 
+# Every byte except the lowercase hex digits, to be deleted by bytes.translate
+_NON_HEX_BYTES = bytes(b for b in range(256) if b not in b"0123456789abcdef")
+
+
 def hex_to_int(hex_str):
     """
     Given a hex string, this function will return the integer value of the hex.
     If there is any non hex character, it will be ignored.
     """
-    hex_clean = "".join([c for c in hex_str if c in "0123456789abcdef"])
+    # non-ascii characters are encoded as bytes >= 0x80, so they are deleted as well
+    hex_clean = hex_str.encode("utf-8").translate(None, _NON_HEX_BYTES)
     return int(hex_clean, 16)
 
 
@@ -160,44 +353,47 @@ def load_demo_names_in_split(
     """
     split_path = Path(split_path).expanduser()
 
-    with open(split_path) as f:
-        splits = json.load(f)
+    if _orjson is not None:
+        splits = _orjson.loads(split_path.read_bytes())
+    else:
+        with open(split_path) as f:
+            splits = json.load(f)
 
     demo_names = splits[split]
 
     if sample_size is not None:
-        import random
-
-        random.seed(random_state)
-        demo_names = random.sample(demo_names, sample_size)
+        # A local generator gives the same sample as seeding the global one, without
+        # changing the global random state
+        demo_names = random.Random(random_state).sample(demo_names, sample_size)
 
     return demo_names
 
 
+_UTF8_NAMES = ("utf-8", "utf8", "utf_8")
+
+
 def auto_read_json(path, backend="auto", encoding=None):
     path = str(path)
-    if backend in ["auto", "orjson"] and find_spec("orjson"):
-        import orjson
-
+    if backend in ["auto", "orjson"] and _orjson is not None:
         backend = "orjson"
-
-    elif backend in ["auto", "ujson"] and find_spec("ujson"):
-        import ujson
-
+    elif backend in ["auto", "ujson"] and _ujson is not None:
         backend = "ujson"
-
     else:
-        import json
-
         backend = "json"
 
+    # orjson only accepts utf-8, so the bytes are given to it directly instead of
+    # decoding them to a str first, unless another encoding was requested
+    if backend == "orjson" and (encoding is None or encoding.lower() in _UTF8_NAMES):
+        with open(path, "rb") as f:
+            return _orjson.loads(f.read())
+
     with open(path, encoding=encoding) as f:
         if backend == "json":
             data = json.load(f)
         elif backend == "ujson":
-            data = ujson.load(f)
+            data = _ujson.load(f)
         elif backend == "orjson":
-            data = orjson.loads(f.read())
+            data = _orjson.loads(f.read())
         else:
             raise ValueError(
                 f"Invalid backend '{backend}'. Must be either 'auto', 'json', 'ujson', or 'orjson'"
@@ -206,78 +402,126 @@ def auto_read_json(path, backend="auto", encoding=None):
     return data
 
 
-
 def auto_save_json(data, path, backend="auto", indent=0):
     if indent is None:
         indent = 0
-    
-    path = str(path)
-    if backend in ["auto", "orjson"] and find_spec("orjson") and indent not in [2, 0]:
-        import orjson
 
+    path = str(path)
+    if backend in ["auto", "orjson"] and _orjson is not None and indent not in [2, 0]:
         backend = "orjson"
-
-    elif backend in ["auto", "ujson"] and find_spec("ujson"):
-        import ujson
-
+    elif backend in ["auto", "ujson"] and _ujson is not None:
         backend = "ujson"
-
     else:
-        import json
-
         backend = "json"
 
     if backend == "json":
-        with open(path, "w") as f:
-            json.dump(data, f, indent=indent)
+        mode, write = "w", partial(json.dump, indent=indent)
     elif backend == "ujson":
-        with open(path, "w") as f:
-            ujson.dump(data, f, indent=indent)
+        mode, write = "w", partial(_ujson.dump, indent=indent)
     elif backend == "orjson":
         if indent == 2:
-            option = orjson.OPT_INDENT_2
+            option = _orjson.OPT_INDENT_2
         elif indent == 0:
             option = None
         else:
             raise ValueError(
                 f"Invalid indent value {indent}. Must be either 2, 4, or None"
             )
-        with open(path, "wb") as f:
-            f.write(orjson.dumps(data, option=option))
+        mode = "wb"
+        write = lambda data, f: f.write(_orjson.dumps(data, option=option))
     else:
         raise ValueError(
             f"Invalid backend '{backend}'. Must be either 'auto', 'json', 'ujson', or 'orjson'"
         )
 
+    with open(path, mode) as f:
+        write(data, f)
+
+
+def save_results(
+    results, result_dir, filename="results.json", indent=None, backend="json"
+):
+    """
+    Saves the results as json in `result_dir / filename`. By default, the json is
+    compact, which is about half the size of the indented json; use indent=2 to get
+    a human-readable (and diffable) file instead.
+
+    `backend` can be either 'json' or 'orjson'. 'orjson' is faster, but it writes NaN
+    and infinite values as null (whereas 'json' writes NaN and Infinity), so it should
+    only be used when the results do not contain non-finite floats.
+    """
+    if backend not in ("json", "orjson"):
+        raise ValueError(
+            f"Invalid backend '{backend}'. Must be either 'json' or 'orjson'"
+        )
+
+    if backend == "orjson" and _orjson is None:
+        raise ImportError(
+            "orjson is not installed. Please change your backend or install "
+            "it with `pip install orjson`"
+        )
 
-def save_results(results, result_dir, filename="results.json"):
     result_dir = Path(result_dir).expanduser()
     result_dir.mkdir(parents=True, exist_ok=True)
-    with open(result_dir / filename, "w") as f:
-        json.dump(results, f, indent=2)
+    path = result_dir / filename
 
+    # orjson writes the bytes directly, but only supports an indent of 2; json is used
+    # otherwise, or if it cannot serialize the results (e.g. integers over 64 bits)
+    if backend == "orjson" and indent in [None, 2]:
+        option = _orjson.OPT_NON_STR_KEYS
+        if indent == 2:
+            option |= _orjson.OPT_INDENT_2
 
-def set_seed(seed):
-    import random
+        try:
+            data = _orjson.dumps(results, option=option)
+        except TypeError:
+            pass
+        else:
+            path.write_bytes(data)
+            return
+
+    separators = (",", ":") if indent is None else None
+    with open(path, "w") as f:
+        json.dump(results, f, indent=indent, separators=separators)
 
-    random.seed(seed)
 
+@lru_cache(maxsize=None)
+def _import_optional_module(name):
+    """
+    Imports the module `name` the first time it is requested, and returns None if it is
+    not installed. Heavy modules like torch are only imported when first needed, rather
+    than when this module is imported.
+    """
     try:
-        import numpy as np
+        return import_module(name)
+    except ImportError:
+        return None
+
+
+def set_seed(seed, deterministic=False):
+    """
+    Sets the seed of python's random, and of numpy and torch if they are installed.
+
+    If deterministic is True, cudnn is also set to only use deterministic algorithms,
+    which can be slower, so it is left unchanged by default.
+    """
+    random.seed(seed)
 
+    np = _import_optional_module("numpy")
+    if np is not None:
         np.random.seed(seed)
 
-    except ImportError:
-        pass
+    torch = _import_optional_module("torch")
+    if torch is None:
+        return
 
     try:
-        import torch
-
         torch.manual_seed(seed)
         torch.cuda.manual_seed_all(seed)
 
-    except ImportError:
-        pass
+        if deterministic:
+            torch.backends.cudnn.deterministic = True
+            torch.backends.cudnn.benchmark = False
 
     except Exception as e:
         print(f"Error setting seed for torch: {e}")
@@ -290,16 +534,18 @@ def filter_records(records: list, **kwargs):
     that contain a "demo_name" key and a "turn_index" key, then you can
     find all records that match a given demo_name and turn_index by doing
     find_record(records, demo_name="demo_1", turn_index=0).
+
+    This scans all the records; to filter the same records many times, build a
+    `weblinx.utils.recs.RecordIndex` once and use its `filter` method instead.
     """
-    matches = []
-    for record in records:
-        is_match = True
-        for k, v in kwargs.items():
-            if record[k] != v:
-                is_match = False
-                break
+    if not kwargs:
+        return list(records)
 
-        if is_match:
-            matches.append(record)
+    if len(kwargs) == 1:
+        ((key, value),) = kwargs.items()
+        return [record for record in records if record[key] == value]
 
-    return matches
+    # The keys are compared one by one and stop at the first mismatch, so records
+    # that mismatch on an earlier key do not need to have the later keys
+    items = tuple(kwargs.items())
+    return [record for record in records if all(record[k] == v for k, v in items)]
@@ -4,7 +4,8 @@ from pathlib import Path
 
 def get_env_dict(filepath: str = ".env") -> dict:
     """
-    Get environment variables from a .env file.
+    Get environment variables from a .env file. Blank lines and lines starting
+    with '#' are ignored.
 
     Parameters
     ----------
@@ -20,11 +21,17 @@ def get_env_dict(filepath: str = ".env") -> dict:
     if not path.is_file():
         raise FileNotFoundError(f"File not found: {filepath}")
 
-    with path.open() as f:
-        env_vars = f.readlines()
-        # Split by first =, conver to dict
-        env_vars_list = [line.split("=", 1) for line in env_vars]
-        env_vars_dict = {key: value.strip() for key, value in env_vars_list}
+    env_vars_dict = {}
+    # Read at once, then split each line by the first =, skipping blank and comment lines
+    for line in path.read_text().splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+
+        key, sep, value = line.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid line in {filepath}, expected KEY=VALUE: {line}")
+
+        env_vars_dict[key] = value.strip()
 
     return env_vars_dict
 
@@ -40,5 +47,4 @@ def set_env_vars(filepath: str = ".env") -> None:
 
     """
     env_vars_dict = get_env_dict(filepath)
-    for key, value in env_vars_dict.items():
-        os.environ[key] = value
+    os.environ.update(env_vars_dict)
@@ -4,22 +4,25 @@ For example, it can format a turn with intent click into a readable format, like
 click("<button>Click me</button>", x=100, y=200).
 """
 
-from datetime import datetime
-from functools import partial
+from functools import lru_cache
 from typing import Callable
 
 
+_RETURN_AS_NAMES = {"str": "str", str: "str", "dict": "dict", dict: "dict"}
+
+
 def _validate_return_as(return_as):
-    if return_as not in ["str", str, "dict", dict]:
+    try:
+        name = _RETURN_AS_NAMES.get(return_as)
+    except TypeError:  # unhashable, so it cannot be valid
+        name = None
+
+    if name is None:
         raise ValueError(
             f"return_as must be either 'str' or 'dict', but got {return_as}"
         )
-    if return_as is str:
-        return_as = "str"
-    elif return_as is dict:
-        return_as = "dict"
 
-    return return_as
+    return name
 
 
 def _validate_intent(turn, *intents):
@@ -48,16 +51,54 @@ def compose_formatters(formatters: list) -> Callable:
         A function that will call each formatter in order, and merge the results into
         a single dictionary.
     """
+    # The common cases of 1 to 3 formatters are merged with a single dict display,
+    # rather than by looping over the formatters and calling update for each of them
+    if len(formatters) == 1:
+        (f0,) = formatters
 
-    def formatter(turn: "Turn") -> dict:
-        output = {}
-        for f in formatters:
-            output.update(f(turn))
-        return output
+        def formatter(turn: "Turn") -> dict:
+            return {**f0(turn)}
+
+    elif len(formatters) == 2:
+        f0, f1 = formatters
+
+        def formatter(turn: "Turn") -> dict:
+            return {**f0(turn), **f1(turn)}
+
+    elif len(formatters) == 3:
+        f0, f1, f2 = formatters
+
+        def formatter(turn: "Turn") -> dict:
+            return {**f0(turn), **f1(turn), **f2(turn)}
+
+    else:
+
+        def formatter(turn: "Turn") -> dict:
+            output = {}
+            for f in formatters:
+                output.update(f(turn))
+            return output
 
     return formatter
 
 
+@lru_cache(maxsize=128)
+def _compose_formatters_cached(formatters: tuple) -> Callable:
+    return compose_formatters(formatters)
+
+
+def _get_composed_formatter(formatters) -> Callable:
+    """
+    Returns `compose_formatters(formatters)`, which is built once per tuple of
+    formatters (e.g. the default formatters of `format_click`) rather than at every
+    call. Formatters that cannot be hashed are composed at every call.
+    """
+    try:
+        return _compose_formatters_cached(tuple(formatters))
+    except TypeError:
+        return compose_formatters(formatters)
+
+
 def shorten(text: str, max_length: int = None) -> str:
     """
     This function will shorten a text to a maximum length. If the text is shorter
@@ -78,7 +119,7 @@ def shorten(text: str, max_length: int = None) -> str:
     str
         The shortened text.
     """
-    if max_length in [None, -1]:
+    if max_length is None or max_length == -1:
         return text
 
     if len(text) <= max_length:
@@ -127,12 +168,15 @@ def format_arg_item(turn, name, strip=True, max_length=40, return_as="dict"):
         return output
 
 
+_DEFAULT_KV_TEMPLATE = "{k}={v}"
+
+
 def format_output_dictionary(
     out_dict,
     function_key=None,
     default_function_name="",
     sep=", ",
-    kv_template="{k}={v}",
+    kv_template=_DEFAULT_KV_TEMPLATE,
     add_quotes=True,
     de_escape=True,
     return_as="str",
@@ -197,8 +241,6 @@ def format_output_dictionary(
             f"function_key must be a string, but got '{type(function_key)}'"
         )
 
-    d_without_text = {k: v for k, v in out_dict.items() if k != function_key}
-
     if function_key is None:
         function_name = default_function_name
     elif function_key not in out_dict:
@@ -211,16 +253,26 @@ def format_output_dictionary(
     else:
         function_name = out_dict[function_key]
 
-    if add_quotes:
-        d_without_text = {
-            k: f'"{v}"' if isinstance(v, str) else v for k, v in d_without_text.items()
-        }
-    if de_escape:
-        d_without_text = {
-            k: v.replace("\n", "\\n").replace("\t", "\\t") if isinstance(v, str) else v
-            for k, v in d_without_text.items()
-        }
-    joined = sep.join([kv_template.format(k=k, v=v) for k, v in d_without_text.items()])
+    # The values are quoted, de-escaped and formatted in a single pass over the items
+    use_default_template = kv_template == _DEFAULT_KV_TEMPLATE
+    parts = []
+    for k, v in out_dict.items():
+        if k == function_key:
+            continue
+
+        if isinstance(v, str):
+            if add_quotes:
+                v = f'"{v}"'
+            if de_escape:
+                v = v.replace("\n", "\\n").replace("\t", "\\t")
+
+        if use_default_template:
+            # Same output as the default template, without parsing it for every pair
+            parts.append(f"{k}={v}")
+        else:
+            parts.append(kv_template.format(k=k, v=v))
+
+    joined = sep.join(parts)
 
     return f"{function_name}({joined})"
 
@@ -291,35 +343,53 @@ def format_element(
     """
     return_as = _validate_return_as(return_as)
 
-    if turn.element is None:
+    # turn.element is a property that goes through the turn's action and arguments,
+    # so it is only accessed once
+    element = turn.element
+    if element is None:
         return None
 
     output = {}
 
     # First, let's add tag
-    output["tag"] = turn.element["tagName"].lower()
+    output["tag"] = element["tagName"].lower()
 
     # Let's now add attributes
+    # The attributes are filtered and shortened in a single pass
+    all_attrs = element["attributes"]
     if include_attrs is True:
-        attrs = turn.element["attributes"]
+        items = all_attrs.items()
     elif isinstance(include_attrs, list):
-        attrs = {
-            k: v for k, v in turn.element["attributes"].items() if k in include_attrs
-        }
+        include_attrs = set(include_attrs)
+        items = [(k, v) for k, v in all_attrs.items() if k in include_attrs]
     else:
-        attrs = {}
+        items = ()
 
-    attrs = {k: shorten(v, max_length=max_attr_length) for k, v in attrs.items()}
+    if max_attr_length is None or max_attr_length == -1:
+        attrs = dict(items)
+    else:
+        # shorten is only called for the values that are too long
+        attrs = {
+            k: v if len(v) <= max_attr_length else shorten(v, max_attr_length)
+            for k, v in items
+        }
     output["attrs"] = attrs
 
     # Finally, let's add text
     if include_text:
-        tc = turn.element["textContent"]
+        tc = element["textContent"]
         if strip_text:
             tc = tc.strip()
-        output["text"] = shorten(tc, max_length=max_text_length)
+        no_max_length = max_text_length is None or max_text_length == -1
+        if no_max_length or len(tc) <= max_text_length:
+            output["text"] = tc
+        else:
+            output["text"] = shorten(tc, max_length=max_text_length)
+
+    if return_as == "dict":
+        return output
 
-    return format_output_dictionary(output, function_key="tag", return_as=return_as)
+    return format_output_dictionary(output, function_key="tag")
 
 
 def format_float(value, decimal=0):
@@ -348,15 +418,15 @@ def format_float(value, decimal=0):
     ValueError
         If decimal is not an integer.
     """
+    # decimal=0 is the default of all the callers, so it is checked first
+    if decimal == 0:
+        return int(value)
     if decimal is None:
-        pass
-    elif decimal == 0:
-        value = int(value)
-    elif isinstance(decimal, int):
-        value = round(value, decimal)
-    else:
-        raise ValueError(f"decimal must be an integer or `None`, but got {decimal}.")
-    return value
+        return value
+    if isinstance(decimal, int):
+        return round(value, decimal)
+
+    raise ValueError(f"decimal must be an integer or `None`, but got {decimal}.")
 
 
 def format_mouse_xy(turn, decimal=0, return_as="dict"):
@@ -403,9 +473,14 @@ def format_mouse_xy(turn, decimal=0, return_as="dict"):
         "y": format_float(y, decimal=decimal),
     }
 
-    return format_output_dictionary(
-        output, default_function_name="mouse", return_as=return_as
-    )
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, default_function_name="mouse")
+
+
+# Output of format_target_bbox when the element has no bounding box
+_MISSING_BBOX = {"top": -1, "left": -1, "right": -1, "bottom": -1}
 
 
 def format_target_bbox(turn, decimal: int = 0, return_as: str = "dict"):
@@ -432,20 +507,19 @@ def format_target_bbox(turn, decimal: int = 0, return_as: str = "dict"):
     formatted : str or dict
         A string or dictionary representing the bounding box.
     """
-    bboxes = turn.element.get("bbox", {})
+    bboxes = turn.element.get("bbox") or {}
     if len(bboxes) == 0:
-        output = {"top": -1, "left": -1, "right": -1, "bottom": -1}
+        output = _MISSING_BBOX.copy()
+    else:
+        output = {
+            side: format_float(bboxes[side], decimal=decimal)
+            for side in ("top", "left", "right", "bottom")
+        }
 
-    output = {
-        "top": format_float(bboxes["top"], decimal=decimal),
-        "left": format_float(bboxes["left"], decimal=decimal),
-        "right": format_float(bboxes["right"], decimal=decimal),
-        "bottom": format_float(bboxes["bottom"], decimal=decimal),
-    }
+    if return_as == "dict":
+        return output
 
-    return format_output_dictionary(
-        output, default_function_name="bounding_box", return_as=return_as
-    )
+    return format_output_dictionary(output, default_function_name="bounding_box")
 
 
 def format_uid(turn, uid_key="data-webtasks-id", return_as="dict"):
@@ -468,11 +542,18 @@ def format_uid(turn, uid_key="data-webtasks-id", return_as="dict"):
     formatted : str or dict
         A string or dictionary representing the uid.
     """
-    if turn.element is None:
+    element = turn.element
+    if element is None:
         raise ValueError(f"format_uid received a turn object with turn.element missing (None): {turn}")
-    output = {"uid": turn.element.get("attributes", {}).get(uid_key, None)}
+    output = {"uid": element.get("attributes", {}).get(uid_key, None)}
+
+    if return_as == "dict":
+        return output
 
-    return format_output_dictionary(output, return_as=return_as)
+    return format_output_dictionary(output)
+
+
+_DEFAULT_TIME_TEMPLATE = "{m:02}:{s:02}"
 
 
 def format_timestamp(
@@ -480,7 +561,7 @@ def format_timestamp(
     timestamp=None,
     start_time=0,
     convert_to_minutes=True,
-    time_template="{m:02}:{s:02}",
+    time_template=_DEFAULT_TIME_TEMPLATE,
     decimal=0,
     return_as="dict",
 ):
@@ -531,18 +612,16 @@ def format_timestamp(
     timestamp = turn.timestamp - start_time
 
     if convert_to_minutes:
-        if timestamp < 0:
-            negative = True
-            mins = int((-timestamp) // 60)
-            secs = (-timestamp) % 60
-        else:
-            negative = False
-            mins = int(timestamp // 60)
-            secs = timestamp % 60
-
+        negative = timestamp < 0
+        mins, secs = divmod(-timestamp if negative else timestamp, 60)
+        mins = int(mins)
         secs = format_float(secs, decimal=decimal)
 
-        timestamp = time_template.format(m=mins, s=secs)
+        if time_template == _DEFAULT_TIME_TEMPLATE:
+            # Same output as the default template, without parsing it at every call
+            timestamp = f"{mins:02}:{secs:02}"
+        else:
+            timestamp = time_template.format(m=mins, s=secs)
 
         if negative:
             timestamp = "-" + timestamp
@@ -556,13 +635,27 @@ def format_timestamp(
         return {"timestamp": timestamp}
 
 
+# Default sub-formatters of the intent formatters below; plain functions are called with
+# less overhead than partial objects
+def _format_value_arg(turn):
+    return format_arg_item(turn, name="value")
+
+
+def _format_text_arg(turn):
+    return format_arg_item(turn, name="text")
+
+
+def _format_element_without_text(turn):
+    return format_element(turn, include_text=False)
+
+
 # INTENT FORMATTING STARTS HERE
 
 
 def format_change(
     turn,
     formatters=(
-        partial(format_arg_item, name="value"),
+        _format_value_arg,
         format_element,
         format_timestamp,
     ),
@@ -597,10 +690,13 @@ def format_change(
     return_as = _validate_return_as(return_as)
     _validate_intent(turn, "change")
 
-    output = compose_formatters(formatters)(turn)
-    output["intent"] = output.get("intent", "change")
+    output = _get_composed_formatter(formatters)(turn)
+    output.setdefault("intent", "change")
+
+    if return_as == "dict":
+        return output
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_click(
@@ -635,10 +731,13 @@ def format_click(
     """
     return_as = _validate_return_as(return_as)
     _validate_intent(turn, "click")
-    output = compose_formatters(formatters)(turn)
-    output["intent"] = output.get("intent", "click")
+    output = _get_composed_formatter(formatters)(turn)
+    output.setdefault("intent", "click")
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_copy(turn, max_length=200, include_timestamp=True, return_as="dict"):
@@ -754,10 +853,13 @@ def format_hover(
     return_as = _validate_return_as(return_as)
     _validate_intent(turn, "hover")
 
-    output = compose_formatters(formatters)(turn)
-    output["intent"] = output.get("intent", "hover")
+    output = _get_composed_formatter(formatters)(turn)
+    output.setdefault("intent", "hover")
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_load(
@@ -832,27 +934,32 @@ def format_load(
     return_as = _validate_return_as(return_as)
     _validate_intent(turn, "load")
 
-    url = turn.props.get("url") or turn.get("url")
+    # turn.props is a property, so it is only accessed once
+    props = turn.props
+    url = props.get("url") or turn.get("url")
     url = shorten(url, max_length=max_length)
 
     output = {"intent": "load", "url": url}
 
     if include_transition:
-        if "transitionType" in turn.props:
-            output["type"] = turn.props["transitionType"]
+        if "transitionType" in props:
+            output["type"] = props["transitionType"]
 
-        if "transitionQualifiers" in turn.props:
-            output["qualifiers"] = turn.props["transitionQualifiers"]
-
-        if join_qualifiers is not None and "qualifiers" in output:
-            output["qualifiers"] = join_qualifiers.join(output["qualifiers"])
+        if "transitionQualifiers" in props:
+            qualifiers = props["transitionQualifiers"]
+            if join_qualifiers is not None:
+                qualifiers = join_qualifiers.join(qualifiers)
+            output["qualifiers"] = qualifiers
 
     if include_timestamp is True:
         output["timestamp"] = format_timestamp(turn, return_as="str")
     elif callable(include_timestamp):
         output["timestamp"] = include_timestamp(turn)
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_say(turn, include_timestamp=True, max_length=200, return_as="dict"):
@@ -927,7 +1034,10 @@ def format_scroll(turn, decimal=0, include_timestamp=True, return_as="dict"):
     if include_timestamp:
         output["timestamp"] = format_timestamp(turn, return_as="str")
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_submit(
@@ -953,11 +1063,14 @@ def format_submit(
     return_as = _validate_return_as(return_as)
     _validate_intent(turn, "submit")
 
-    output = compose_formatters(formatters)(turn)
+    output = _get_composed_formatter(formatters)(turn)
 
-    output["intent"] = output.get("intent", "submit")
+    output.setdefault("intent", "submit")
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_tab(turn, return_as="dict"):
@@ -976,14 +1089,17 @@ def format_tab(turn, return_as="dict"):
 
     output["target"] = turn.props.get("tabId", "Unknown")
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
 
 
 def format_text_input(
     turn,
     formatters=(
-        partial(format_arg_item, name="text"),
-        partial(format_element, include_text=False),
+        _format_text_arg,
+        _format_element_without_text,
         format_timestamp,
     ),
     return_as="dict",
@@ -1017,10 +1133,57 @@ def format_text_input(
     return_as = _validate_return_as(return_as)
     _validate_intent(turn, "textInput")
 
-    output = compose_formatters(formatters)(turn)
-    output["intent"] = output.get("intent", "text_input")
+    output = _get_composed_formatter(formatters)(turn)
+    output.setdefault("intent", "text_input")
+
+    if return_as == "dict":
+        return output
+
+    return format_output_dictionary(output, function_key="intent")
+
+
+def _build_intent_to_formatter(
+    format_change,
+    format_click,
+    format_copy,
+    format_hover,
+    format_load,
+    format_paste,
+    format_scroll,
+    format_submit,
+    format_tab,
+    format_text_input,
+):
+    return {
+        "change": format_change,
+        "click": format_click,
+        "copy": format_copy,
+        "hover": format_hover,
+        "load": format_load,
+        "paste": format_paste,
+        "scroll": format_scroll,
+        "submit": format_submit,
+        "tabcreate": format_tab,
+        "tabremove": format_tab,
+        "tabswitch": format_tab,
+        "textInput": format_text_input,
+    }
+
 
-    return format_output_dictionary(output, function_key="intent", return_as=return_as)
+# Built once, and used by format_intent_automatically unless formatters are overridden
+_DEFAULT_INTENT_FORMATTERS = (
+    format_change,
+    format_click,
+    format_copy,
+    format_hover,
+    format_load,
+    format_paste,
+    format_scroll,
+    format_submit,
+    format_tab,
+    format_text_input,
+)
+_INTENT_TO_FORMATTER = _build_intent_to_formatter(*_DEFAULT_INTENT_FORMATTERS)
 
 
 def format_intent_automatically(
@@ -1050,24 +1213,27 @@ def format_intent_automatically(
         If the intent is not recognized.
     """
     return_as = _validate_return_as(return_as)
-    intent_to_function = {
-        "change": format_change,
-        "click": format_click,
-        "copy": format_copy,
-        "hover": format_hover,
-        "load": format_load,
-        "paste": format_paste,
-        "scroll": format_scroll,
-        "submit": format_submit,
-        "tabcreate": format_tab,
-        "tabremove": format_tab,
-        "tabswitch": format_tab,
-        "textInput": format_text_input,
-    }
 
     if turn.type == "chat":
         return format_say(turn, return_as=return_as)
 
+    formatters = (
+        format_change,
+        format_click,
+        format_copy,
+        format_hover,
+        format_load,
+        format_paste,
+        format_scroll,
+        format_submit,
+        format_tab,
+        format_text_input,
+    )
+    if formatters == _DEFAULT_INTENT_FORMATTERS:
+        intent_to_function = _INTENT_TO_FORMATTER
+    else:
+        intent_to_function = _build_intent_to_formatter(*formatters)
+
     if turn.intent not in intent_to_function:
         accepted = list(intent_to_function.keys()) + ["say"]
         raise ValueError(
@@ -1075,3 +1241,49 @@ def format_intent_automatically(
         )
 
     return intent_to_function[turn.intent](turn, return_as=return_as)
+
+
+def format_turns(turns, return_as="dict") -> list:
+    """
+    Formats a list of turns (e.g. all the turns of a replay) with the default formatter
+    of each turn's intent, like calling `format_intent_automatically` on each turn.
+    The validation and the mapping of the intents to the formatters are done once for
+    all the turns, rather than once per turn.
+
+    Parameters
+    ----------
+    turns : list of Turn
+        The turns to be formatted.
+
+    return_as : str
+        Whether to return each formatted turn as a string or a dictionary.
+
+    Returns
+    -------
+    list of str or dict
+        The formatted turns, in the same order as `turns`.
+
+    Raises
+    ------
+    ValueError
+        If the intent of a turn is not recognized.
+    """
+    return_as = _validate_return_as(return_as)
+    get_formatter = _INTENT_TO_FORMATTER.get
+
+    formatted = []
+    for turn in turns:
+        if turn.type == "chat":
+            formatter = format_say
+        else:
+            formatter = get_formatter(turn.intent)
+
+        if formatter is None:
+            accepted = list(_INTENT_TO_FORMATTER.keys()) + ["say"]
+            raise ValueError(
+                f"Intent {turn.intent} not recognized. Make sure it is one of: {accepted}"
+            )
+
+        formatted.append(formatter(turn, return_as=return_as))
+
+    return formatted
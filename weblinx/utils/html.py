@@ -1,4 +1,4 @@
-from copy import deepcopy
+_MISSING = object()
 
 
 def has_elem_in_viewport(
@@ -32,38 +32,87 @@ def has_elem_in_viewport(
     if turn is None:
         return False
 
-    if turn.bboxes is None:
+    bboxes = turn.bboxes
+    if bboxes is None:
         if verbose:
             print(f"[i={turn.index}] No bboxes")
         return False
 
-    if key not in attrib_dict:
+    wid = attrib_dict.get(key, _MISSING)
+    if wid is _MISSING:
         if verbose:
             print(f"[i={turn.index}] No {key} attribute")
         return False
 
-    if (wid := attrib_dict[key]) not in turn.bboxes:
+    box = bboxes.get(wid)
+    if box is None:
         if verbose:
             print(f"[i={turn.index}] No bbox for {key}={wid}")
         return False
 
-    box = turn.bboxes[wid]
+    return _is_box_in_viewport(
+        box, turn.viewport_width, turn.viewport_height, min_height, min_width
+    )
 
-    if box is None:
-        if verbose:
-            print(f"[i={turn.index}] No bbox for {key}={wid}")
-        return False
 
+def has_elems_in_viewport_batch(
+    turn,
+    attrib_dicts,
+    key="data-webtasks-id",
+    min_height=2,
+    min_width=2,
+):
+    """
+    Batched version of `has_elem_in_viewport`, which reads the bboxes and the viewport
+    of the turn once for all the elements.
+
+    Parameters
+    ----------
+    turn : webtasks.Turn
+        The turn to check.
+    attrib_dicts : iterable of dict
+        The attributes of each element, see `has_elem_in_viewport` for more details.
+    key : str, optional
+        The key to use to find the element's ID.
+    min_height : int, optional
+        The minimum height of the element to be considered in the viewport. Defaults to 2.
+    min_width : int, optional
+        The minimum width of the element to be considered in the viewport. Defaults to 2.
+
+    Returns
+    -------
+    list of bool
+        Whether each element is in the viewport, in the same order as `attrib_dicts`.
+    """
+    bboxes = turn.bboxes if turn is not None else None
+    if bboxes is None:
+        return [False for _ in attrib_dicts]
+
+    viewport_width = turn.viewport_width
+    viewport_height = turn.viewport_height
+    results = []
+
+    for attrib_dict in attrib_dicts:
+        wid = attrib_dict.get(key, _MISSING)
+        box = bboxes.get(wid) if wid is not _MISSING else None
+        results.append(
+            box is not None
+            and _is_box_in_viewport(
+                box, viewport_width, viewport_height, min_height, min_width
+            )
+        )
+
+    return results
+
+
+def _is_box_in_viewport(box, viewport_width, viewport_height, min_height, min_width):
     if box["width"] < min_width or box["height"] < min_height:
         return False
 
-    if turn.viewport_width is None or turn.viewport_height is None:
+    if viewport_width is None or viewport_height is None:
         return True
 
-    if box["x"] > turn.viewport_width or box["y"] > turn.viewport_height:
-        return False
-
-    return True
+    return not (box["x"] > viewport_width or box["y"] > viewport_height)
 
 
 def open_html_with_encodings(path, encodings=["utf-8", "latin-1"], raise_error=True):
@@ -85,17 +134,28 @@ def open_html_with_encodings(path, encodings=["utf-8", "latin-1"], raise_error=T
     lxml.html.HtmlElement
         The HTML element.
     """
+    # The bytes are read once and decoded with each encoding, instead of reopening
+    # and rereading the file for every encoding that fails
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        if raise_error:
+            raise
+        else:
+            return None
+
     for encoding in encodings:
         try:
-            with open(path, encoding=encoding) as f:
-                return f.read()
+            text = data.decode(encoding)
         except UnicodeDecodeError:
             continue
-        except FileNotFoundError:
-            if raise_error:
-                raise
-            else:
-                return None
+
+        # Same newline translation as reading in text mode
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+
     if raise_error:
         raise ValueError(f"Could not open {path} with encodings {encodings}")
     else:
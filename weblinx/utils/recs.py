@@ -4,28 +4,53 @@ A module dedicated to manipulating and working with lists and records (which are
 
 from copy import deepcopy
 from collections import defaultdict
+from operator import itemgetter
+import pickle
 from typing import Any, List, Dict
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def is_list_monotonically_increasing(lst: list) -> bool:
+
+def is_list_monotonically_increasing(lst: list, strict: bool = False) -> bool:
     """
     This function checks if a list is monotonically increasing.
 
     Parameters
     ----------
     lst : list
-        The list to check.
+        The list to check. If it is a numpy array, the check is vectorized.
+
+    strict : bool
+        Whether each element must be strictly greater than the previous one,
+        instead of greater or equal.
 
     Returns
     -------
     bool
         True if the list is monotonically increasing, False otherwise.
     """
+    if np is not None and isinstance(lst, np.ndarray):
+        if strict:
+            return bool(np.all(lst[1:] > lst[:-1]))
+        return bool(np.all(lst[1:] >= lst[:-1]))
+
+    if len(lst) == 0:
+        return True
+
     l = lst[0]
-    for x in lst[1:]:
-        if x < l:
-            return False
-        l = x
+    if strict:
+        for x in lst[1:]:
+            if x <= l:
+                return False
+            l = x
+    else:
+        for x in lst[1:]:
+            if x < l:
+                return False
+            l = x
 
     return True
 
@@ -40,15 +65,21 @@ def get_list_from_records_by_key(records: dict, key: str) -> list:
     records : dict
         A list of dictionaries to extract the values from.
 
-    key : str
-        The key to extract from the records.
+    key : str or tuple of str
+        The key to extract from the records. If a tuple of keys is given, the values
+        of all the keys are extracted from each record as a tuple.
 
     Returns
     -------
     list
         A list of values from the records based on the key.
     """
-    return [r[key] for r in records]
+    if isinstance(key, tuple):
+        if len(key) == 1:
+            return [(record[key[0]],) for record in records]
+        return list(map(itemgetter(*key), records))
+
+    return list(map(itemgetter(key), records))
 
 
 def insert_list_into_records_by_key(records: dict, key: str, lst: list) -> None:
@@ -91,12 +122,24 @@ def insert_list_into_records_by_key(records: dict, key: str, lst: list) -> None:
         The list to insert into the records.
     """
     assert len(records) == len(lst), "Records and list must be the same length"
-    for i in range(len(records)):
-        records[i][key] = lst[i]
+    for record, value in zip(records, lst):
+        record[key] = value
+
+
+def _deepcopy_records(records: List[dict]) -> List[dict]:
+    """
+    Deep copies a list of records. Records loaded from json only contain built-in types,
+    which can be copied with a pickle round trip much faster than with `deepcopy`; if the
+    records cannot be pickled, `deepcopy` is used instead.
+    """
+    try:
+        return pickle.loads(pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return deepcopy(records)
 
 
 def group_record_to_dict(
-    records: List[dict], keys, remove_keys=False, copy=True
+    records: List[dict], keys, remove_keys=False, copy=True, deep=False
 ) -> Dict[Any, List[dict]]:
     """
     Given a list of dictionaries, this function groups the dictionaries by the
@@ -116,20 +159,43 @@ def group_record_to_dict(
     copy: bool
         Whether to copy the dictionaries in the output before returning. If
         False, then the dictionaries of the input records will be modified in place.
+    deep: bool
+        Whether the copies are deep copies. By default, the copies are shallow, meaning
+        that the values of the output dictionaries (e.g. nested lists or dicts) are
+        shared with the input records; adding, removing or replacing keys of the output
+        dictionaries does not affect the input records. Ignored if copy is False.
     """
-    grouped = defaultdict(list)
+    if copy and deep:
+        records = _deepcopy_records(list(records))
+    elif copy:
+        records = [record.copy() for record in records]
+
+    # The keys stay tuples even for a single key, since callers (and the restore_keys
+    # of ungroup_dict_to_records) rely on it; itemgetter builds them in C
+    keys = list(keys)
+    if len(keys) == 0:
+        get_key = lambda record: ()
+    elif len(keys) == 1:
+        key_0 = keys[0]
+        get_key = lambda record: (record[key_0],)
+    else:
+        get_key = itemgetter(*keys)
+
+    # A plain dict is returned directly, without converting from a defaultdict
+    grouped = {}
     for record in records:
-        if copy:
-            record = deepcopy(record)
-
-        key = tuple(record[k] for k in keys)
+        key = get_key(record)
         if remove_keys:
             for k in keys:
                 del record[k]
 
-        grouped[key].append(record)
+        group = grouped.get(key)
+        if group is None:
+            grouped[key] = [record]
+        else:
+            group.append(record)
 
-    return dict(grouped)
+    return grouped
 
 
 def ungroup_dict_to_records(grouped_records: dict, restore_keys: list = None) -> list:
@@ -199,15 +265,73 @@ def ungroup_dict_to_records(grouped_records: dict, restore_keys: list = None) ->
     records = []
 
     for k, v in grouped_records.items():
-        for r in v:
-            # Add back the matched restored keys with the values in `k`
-            record = {}
-            if restore_keys is not None:
-                for i, restored_key in enumerate(restore_keys):
-                    record[restored_key] = k[i]
+        if restore_keys is None:
+            records.extend([dict(r) for r in v])
+            continue
 
-            # Add back the rest of the keys
-            record.update(r)
-            records.append(record)
+        # The matched restored keys with the values in `k` are built once per group,
+        # then merged with the rest of the keys of each record
+        restored = dict(zip(restore_keys, k))
+        records.extend([{**restored, **r} for r in v])
 
     return records
+
+
+class RecordIndex:
+    """
+    An index of records (a list of dictionaries) by the values of some of their keys,
+    which can be used to filter the records many times (e.g. once per demo or per turn)
+    without scanning all the records at every call, unlike `filter_records`.
+
+    Parameters
+    ----------
+    records : list of dict
+        The records to index. The records are not copied, so they should not be
+        modified while the index is used.
+
+    keys : list of str
+        The keys to index the records by. The values of these keys must be hashable.
+        Filtering by other keys is still supported, but those are compared record by
+        record, after filtering by the indexed keys.
+
+    Examples
+    --------
+    ```
+    index = RecordIndex(records, keys=["demo_name", "turn_index"])
+    index.filter(demo_name="demo_1", turn_index=0)
+    ```
+    """
+
+    def __init__(self, records: List[dict], keys=("demo_name", "turn_index")):
+        self.records = records
+        self.keys = tuple(keys)
+        self._positions = {k: defaultdict(list) for k in self.keys}
+
+        for i, record in enumerate(records):
+            for k in self.keys:
+                self._positions[k][record[k]].append(i)
+
+    def filter(self, **kwargs) -> List[dict]:
+        """
+        Finds all the records that match the given kwargs, in the same order as in the
+        records, like `filter_records(records, **kwargs)`.
+        """
+        indexed = [k for k in kwargs if k in self._positions]
+        remaining = [(k, v) for k, v in kwargs.items() if k not in self._positions]
+
+        if not indexed:
+            candidates = self.records
+        else:
+            # Start with the smallest list of positions and only keep the positions
+            # present in all others; the lists are sorted so the order is preserved
+            positions = sorted(
+                (self._positions[k].get(kwargs[k], []) for k in indexed), key=len
+            )
+            others = [set(p) for p in positions[1:]]
+            candidates = [
+                self.records[i]
+                for i in positions[0]
+                if all(i in other for other in others)
+            ]
+
+        return [r for r in candidates if all(r[k] == v for k, v in remaining)]
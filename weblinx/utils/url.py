@@ -2,32 +2,52 @@
 This module contains utility functions for manipulating urls.
 """
 
+from functools import lru_cache
 import urllib.parse
 
 
 def shorten_url(url: str, width: int = 50, placeholder: str = "[...]") -> str:
-    actual_width = width - len(placeholder)
-
+    """
+    Shortens a url to at most `width` characters, replacing the end of the url with the
+    placeholder if it is too long. Urls that fit are returned as is.
+    """
     if len(url) <= width:
         return url
+
+    actual_width = width - len(placeholder)
     if actual_width <= 0:
         raise ValueError(
             f"Width is too small. Your placeholder has length {len(placeholder)} but width is {width}."
         )
 
-    return url[:width] + placeholder
+    return url[:actual_width] + placeholder
+
+
+# Second-level labels that form a 2-part tld with the country code, e.g. co.uk, com.au
+_GEO_SECOND_LEVEL_DOMAINS = frozenset(["co", "com", "edu"])
+_DOMAINS_ALLOWING_AC = frozenset(["uk", "in", "jp", "cn", "nz", "kr"])
+
+
+def _get_net_loc(url: str) -> str:
+    # urlsplit gives the same netloc as urlparse, without also splitting the params
+    return urllib.parse.urlsplit(url).netloc
+
+
+def _remove_www_prefix(net_loc: str) -> str:
+    # Only a leading www. is removed, not www. in the middle of the domain name
+    if net_loc.startswith("www."):
+        return net_loc[4:]
+    return net_loc
 
 
 def remove_subdomain(url: str) -> str:
     """
     Given a url, remove the subdomain part, if the subdomain is not in domains_allowed
     """
-
-    tld_length = calculate_length_of_tld(url)
-    # Get the domain name using urllib.parse
-    parsed_url = urllib.parse.urlparse(url)
+    net_loc = _get_net_loc(url)
+    tld_length = _calculate_length_of_tld_of_net_loc(net_loc)
     # Split the domain name by .
-    net_loc_split = parsed_url.netloc.split(".")
+    net_loc_split = net_loc.split(".")
     # Based on the length of the tld, get the domain name (including the tld) and return it
     domain = ".".join(net_loc_split[-(tld_length + 1) :])
 
@@ -52,29 +72,31 @@ def calculate_length_of_tld(url: str) -> int:
     int
         The length of the tld.
     """
-    # Get the domain name using urllib.parse
-    parsed_url = urllib.parse.urlparse(url)
-    # remove www. from the domain name
-    net_loc = parsed_url.netloc.replace("www.", "")
+    return _calculate_length_of_tld_of_net_loc(_get_net_loc(url))
+
+
+# The same domains recur across the turns of a dataset, so the results are cached by
+# domain name (rather than by url, which varies more)
+@lru_cache(maxsize=100_000)
+def _calculate_length_of_tld_of_net_loc(net_loc: str) -> int:
+    net_loc = _remove_www_prefix(net_loc)
     # Split the domain name by .
     net_loc_split = net_loc.split(".")
 
     if len(net_loc_split) == 0:
-        raise ValueError(f"Could not parse the domain name from {url}")
+        raise ValueError(f"Could not parse the domain name from {net_loc}")
 
     # If the length of the split is 1, then return 1
     if len(net_loc_split) == 1:
         return 1
 
-    domains_allowing_ac = ["uk", "in", "jp", "cn", "nz", "kr"]
-
     # Now, check if it's one of co.uk, co.nz, co.in, etc.
-    if net_loc_split[-2] in ["co", "com", "edu"]:
+    if net_loc_split[-2] in _GEO_SECOND_LEVEL_DOMAINS:
         # In this case, the geo tld is co.uk or com.au or co.in, etc.
         # This means it has length of 2
         return 2
 
-    elif net_loc_split[-2] in ["ac"] and net_loc_split[-1] in domains_allowing_ac:
+    elif net_loc_split[-2] == "ac" and net_loc_split[-1] in _DOMAINS_ALLOWING_AC:
         # In this case, the geo tld is ac.uk or ac.in, etc.
         # So still length of 2
         return 2
@@ -98,11 +120,13 @@ def has_valid_tld(url: str) -> bool:
     bool
         True if the url has a valid tld, else False.
     """
+    return _has_valid_tld_of_net_loc(_get_net_loc(url))
+
+
+@lru_cache(maxsize=100_000)
+def _has_valid_tld_of_net_loc(net_loc: str) -> bool:
     # If the length of the tld is 1, then it's valid
-    # Get the domain name using urllib.parse
-    parsed_url = urllib.parse.urlparse(url)
-    # remove www. from the domain name
-    net_loc = parsed_url.netloc.replace("www.", "")
+    net_loc = _remove_www_prefix(net_loc)
     # Split the domain name by .
     net_loc_split = net_loc.split(".")
 
@@ -14,11 +14,12 @@ except ImportError as e:
 from dataclasses import dataclass
 from functools import lru_cache
 import json
+import os
 from pathlib import Path
 from typing import Union
 
 
-from ..__init__ import Replay
+from .. import Replay
 
 
 @dataclass
@@ -54,13 +55,9 @@ class Viewport:
 
     @classmethod
     def from_video_path(cls, video_path: Union[str, Path]):
-        video_path = str(video_path)
+        h, w, _ = _probe_video(str(video_path))
 
-        cap = cv2.VideoCapture(video_path)
-        obj = cls.from_cv2(cap)
-        cap.release()
-
-        return obj
+        return cls(h=h, w=w)
 
     def scale(self, zoom_level: float):
         """
@@ -70,6 +67,46 @@ class Viewport:
         return Viewport(h=int(round(self.h * z)), w=int(round(self.w * z)))
 
 
+# Opening a capture initializes the demuxer, which dominates the cost of reading a few
+# properties, so the properties are cached by path (they do not change for a recording)
+@lru_cache(maxsize=128)
+def _probe_opened_video(video_path: str) -> "tuple[int, int, float]":
+    cap = cv2.VideoCapture(video_path)
+    try:
+        # Raising on failure keeps it out of the cache, so a recording that is missing
+        # (e.g. not downloaded yet) is probed again on the next call
+        if not cap.isOpened():
+            raise ValueError(f"Could not open the video {video_path}")
+
+        view = Viewport.from_cv2(cap)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+    finally:
+        cap.release()
+
+    return view.h, view.w, fps
+
+
+def _probe_video(video_path: str) -> "tuple[int, int, float]":
+    try:
+        return _probe_opened_video(video_path)
+    except ValueError:
+        # Same values as the properties of a capture that could not be opened
+        return 0, 0, 0.0
+
+
+def _open_video_capture(video_path: str, hw_acceleration: bool = False):
+    if not hw_acceleration:
+        return cv2.VideoCapture(video_path)
+
+    # The acceleration has to be requested when opening the capture; OpenCV falls back
+    # to software decoding if no hardware decoder is available
+    return cv2.VideoCapture(
+        video_path,
+        cv2.CAP_FFMPEG,
+        [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY],
+    )
+
+
 @dataclass
 class CropArea:
     x_start: int
@@ -147,6 +184,9 @@ def find_starting_frame(
     max_greenness=0.1,
     max_blueness=0.1,
     callback=None,
+    coarse_stride=1,
+    hw_acceleration=False,
+    subsample=1,
 ):
     """
     Given a video capture, start and end viewports, and a delay, find the index of the
@@ -190,6 +230,24 @@ def find_starting_frame(
         This is useful to track the progress of the function or to display the frame to the user.
         If  you can leave it as `None` if you don't need it.
 
+    coarse_stride : int
+        If larger than 1, only every `coarse_stride`-th frame is decoded and checked until
+        the first red frame is found; the frames in between are only grabbed, which skips
+        their conversion to BGR. The video is then rewound to the frame right after the
+        last checked frame and every frame is checked from there on, so the result is the
+        same as with `coarse_stride=1` as long as the red frames last at least `coarse_stride`
+        frames. The callback is only called for the checked frames. Defaults to 1.
+
+    hw_acceleration : bool
+        Whether to decode the video with a hardware decoder (e.g. VAAPI, NVDEC) if one is
+        available, when `cap_or_path` is a path. The decoded frames may differ slightly
+        from the software decoder. Defaults to False.
+
+    subsample : int
+        If larger than 1, the channel means are computed on every `subsample`-th row and
+        column of the (cropped) frame, which is much faster but only approximates the means.
+        Defaults to 1, which uses every pixel.
+
     Returns
     -------
     int
@@ -197,7 +255,7 @@ def find_starting_frame(
         `cap.set(cv2.CAP_PROP_POS_FRAMES, idx)`.
     """
     if isinstance(cap_or_path, (str, Path)):
-        cap = cv2.VideoCapture(str(cap_or_path))
+        cap = _open_video_capture(str(cap_or_path), hw_acceleration=hw_acceleration)
         release_cap = True
     elif isinstance(cap_or_path, cv2.VideoCapture):
         cap = cap_or_path
@@ -217,38 +275,60 @@ def find_starting_frame(
 
     red_idx = None
 
-    for i in range(num_frames):
+    # The frames are kept as uint8, so the thresholds on the channel means are scaled
+    # from [0, 1] to [0, 255]
+    red_threshold = min_redness * 255
+    green_threshold = max_greenness * 255
+    blue_threshold = max_blueness * 255
+
+    coarse = coarse_stride > 1
+    i = 0
+
+    # The frame count reported by the capture is only an estimate for some codecs, so
+    # the frames are read until the end of the video; num_frames is only passed to the
+    # callback for progress tracking
+    while True:
+        if coarse and i % coarse_stride != 0:
+            if not cap.grab():
+                break
+
+            i += 1
+            continue
+
         ret, frame = cap.read()
 
         if not ret:
-            if release_cap:
-                cap.release()
-
-            return None
+            break
 
         if callback is not None:
             callback(i, num_frames, frame)
 
-        # We need to convert the frame from BGR to RGB.
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
         # We crop the frame to the area of interest if a crop area is provided.
         if crop_area is not None:
             frame = crop_area.crop_numpy(frame)
 
-        frame = frame / 255.0
-        # Higher values mean more red pixels.
-        redness = frame[:, :, 0].mean()
-        # Lower values mean less green pixels.
-        greenness = frame[:, :, 1].mean()
-        # Lower values mean less blue pixels.
-        blueness = frame[:, :, 2].mean()
+        if subsample > 1:
+            frame = frame[::subsample, ::subsample]
+
+        # The frame is in BGR, so the means are in BGR order instead of converting to RGB.
+        # cv2.mean computes the means of all the channels in a single pass over the frame.
+        # Higher values mean more red pixels, lower values mean less green and blue pixels.
+        blueness, greenness, redness, _ = cv2.mean(frame)
 
         if (
-            redness > min_redness
-            and greenness < max_greenness
-            and blueness < max_blueness
+            redness > red_threshold
+            and greenness < green_threshold
+            and blueness < blue_threshold
         ):
+            if coarse and i > 0:
+                # The first red frame may be one of the skipped frames, so we rewind to
+                # the frame after the last checked frame and check every frame from there
+                coarse = False
+                i -= coarse_stride - 1
+                cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+                continue
+
+            coarse = False
             red_idx = i
             countdown_started = True
 
@@ -258,6 +338,8 @@ def find_starting_frame(
         if countdown == 0:
             break
 
+        i += 1
+
     if release_cap:
         cap.release()
 
@@ -273,6 +355,7 @@ def get_start_frame(
     save_to_processed_metadata=True,
     callback=None,
     delay=5,
+    hw_acceleration=False,
 ):
     """
     This is a high-level function that wraps `find_starting_frame`, `get_initial_viewport`,
@@ -293,10 +376,6 @@ def get_start_frame(
         the value of the "start_frame" key if it exists. If it doesn't exist, it will
         run `find_starting_frame` and save the result to the processed metadata file.
 
-    save_to_processed_metadata : bool
-        Whether to save the starting frame to the processed metadata file of the demo.
-        This will save the starting frame to the processed_metadata.json file in the
-        demo's path.
     save_to_processed_metadata : bool
         Whether to save the starting frame to the processed metadata file of the demo.
         This will save the starting frame to the processed_metadata.json file in the
@@ -313,13 +392,15 @@ def get_start_frame(
         want to use the LAST red frame, not the first one, and a delay allows us to wait
         until the last red frame is found.
 
+    hw_acceleration : bool
+        Whether to decode the recording with a hardware decoder if one is available. See
+        `find_starting_frame` for more details. Defaults to False.
+
     Returns
     -------
     int
         The index of the starting frame of the demo.
     """
-    from .. import Replay
-
     metadata_path = Path(demo.path) / "processed_metadata.json"
     if load_from_processed_metadata and metadata_path.exists():
         with open(metadata_path, "r") as fp:
@@ -332,20 +413,34 @@ def get_start_frame(
     replay = Replay.from_demonstration(demo)
     rec_path = demo.get_recording_path()
 
-    crop_area = get_crop_area(
-        full=Viewport.from_video_path(rec_path),
-        cropped=get_initial_viewport(replay),
-    )
+    # A single capture is used to get the viewport of the video and to find the
+    # starting frame, instead of opening the recording twice
+    cap = _open_video_capture(str(rec_path), hw_acceleration=hw_acceleration)
+    try:
+        crop_area = get_crop_area(
+            full=Viewport.from_cv2(cap),
+            cropped=get_initial_viewport(replay),
+        )
 
-    start_frame = find_starting_frame(
-        rec_path, crop_area=crop_area, callback=callback, delay=delay
-    )
+        start_frame = find_starting_frame(
+            cap, crop_area=crop_area, callback=callback, delay=delay
+        )
+    finally:
+        cap.release()
 
     if save_to_processed_metadata:
         metadata["start_frame"] = start_frame
 
-        with open(metadata_path, "w") as fp:
-            json.dump(metadata, fp, indent=2)
+        # The metadata is written to a temporary file that then replaces the original,
+        # so an interrupted write cannot leave a corrupted processed_metadata.json
+        tmp_path = metadata_path.with_name(metadata_path.name + ".tmp")
+        try:
+            with open(tmp_path, "w") as fp:
+                json.dump(metadata, fp)
+            os.replace(tmp_path, metadata_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
 
     return start_frame
 
@@ -369,10 +464,7 @@ def get_fps(video_path: str):
     if not Path(video_path).exists():
         raise ValueError(f"File {video_path} does not exist.")
 
-    cap = cv2.VideoCapture(str(video_path))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    cap.release()
-    return fps
+    return _probe_video(video_path)[2]
 
 
 def get_frame(video_path: str, frame_number: int) -> np.array:
@@ -450,6 +542,20 @@ def frame_num_to_timestamp(frame_num: int, fps: float) -> float:
     return float(frame_num / fps)
 
 
+def _prepare_image_for_drawing(im, convert_to_rgb):
+    """
+    Returns a new image to draw on, and whether it must be converted to RGB after drawing.
+    All the overlays are drawn with solid colors, so an RGB image that should stay RGB is
+    copied and drawn on directly, which gives the same pixels as drawing on an RGBA
+    conversion and converting it back to RGB, without the two conversions.
+    """
+    if im.mode == "RGB" and convert_to_rgb:
+        return im.copy(), False
+
+    # convert always returns a new image, so no copy is needed beforehand
+    return im.convert("RGBA"), convert_to_rgb
+
+
 def draw_bbox(im, intent, bbox, inplace=False, convert_to_rgb=True):
     """
     Draw the bounding box of the element targeted by the action on an image.
@@ -457,7 +563,7 @@ def draw_bbox(im, intent, bbox, inplace=False, convert_to_rgb=True):
     Parameters
     ----------
     im : PIL.Image
-        The image to draw on. This image will be modified in place unless `copy` is True.
+        The image to draw on. It is not modified, the overlay is drawn on a new image.
 
     intent : str
         The type of event. It must be one of "click", "hover", "textInput", or "change".
@@ -468,7 +574,8 @@ def draw_bbox(im, intent, bbox, inplace=False, convert_to_rgb=True):
         `turn.element.get("bbox")`.
 
     inplace : bool
-        Whether to modify the image in place or return a copy.
+        Unused, kept for backward compatibility: a new image is always returned, and the
+        input image is never modified.
 
     convert_to_rgb : bool
         Whether to convert the image to RGB at the end. This is useful for saving to JPEG.
@@ -492,10 +599,7 @@ def draw_bbox(im, intent, bbox, inplace=False, convert_to_rgb=True):
         "change": "green",
     }
 
-    if not inplace:
-        im = im.copy()
-
-    im = im.convert("RGBA")
+    im, convert_at_end = _prepare_image_for_drawing(im, convert_to_rgb)
 
     draw = ImageDraw.Draw(im)
 
@@ -509,7 +613,7 @@ def draw_bbox(im, intent, bbox, inplace=False, convert_to_rgb=True):
 
     draw.rectangle((left, top, left + w, top + h), outline=color, width=2)
 
-    if convert_to_rgb:
+    if convert_at_end:
         im = im.convert("RGB")
 
     return im
@@ -523,7 +627,7 @@ def draw_at_xy(im, intent, x, y, inplace=False, convert_to_rgb=True):
     Parameters
     ----------
     im : PIL.Image
-        The image to draw on. This image will be modified in place unless `copy` is True.
+        The image to draw on. It is not modified, the overlay is drawn on a new image.
 
     intent : str
         The type of event. It must be one of "click", "hover", "textInput", or "change".
@@ -536,7 +640,8 @@ def draw_at_xy(im, intent, x, y, inplace=False, convert_to_rgb=True):
         The y coordinate of the action. You can obtain it by calling `turn.props.get("y")`.
 
     inplace : bool
-        Whether to modify the image in place or return a copy.
+        Unused, kept for backward compatibility: a new image is always returned, and the
+        input image is never modified.
 
     convert_to_rgb : bool
         Whether to convert the image to RGB at the end. This is useful for saving to JPEG.
@@ -565,10 +670,7 @@ def draw_at_xy(im, intent, x, y, inplace=False, convert_to_rgb=True):
             f"Invalid intent '{intent}'. It must be one of {list(colors.keys())}"
         )
 
-    if not inplace:
-        im = im.copy()
-
-    im = im.convert("RGBA")
+    im, convert_at_end = _prepare_image_for_drawing(im, convert_to_rgb)
 
     draw = ImageDraw.Draw(im)
 
@@ -581,7 +683,7 @@ def draw_at_xy(im, intent, x, y, inplace=False, convert_to_rgb=True):
             draw.ellipse((x - rx, y - rx, x + rx, y + rx), outline=color, width=3)
         draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
 
-    if convert_to_rgb:
+    if convert_at_end:
         im = im.convert("RGB")
 
     return im